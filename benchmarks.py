@@ -0,0 +1,300 @@
+"""Benchmarks the parsing, calculation and drawing hot paths of
+equations on synthetic workloads, records their timings and memory
+allocations as JSON and compares them against a stored baseline.
+
+Run with "python benchmarks.py --output results.json", and pass
+"--baseline baseline.json" to fail when any benchmark is slower than
+the baseline by more than the threshold.
+"""
+
+import argparse, json, platform, random, statistics, sys, time
+import tracemalloc
+import equations, sampling, scheduler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Version of the results format written by saveResults.
+resultsVersion = 2
+
+# Size of the canvas drawn by the drawing benchmarks.
+canvasWidth = 500
+canvasHeight = 500
+
+def polynomial(terms:int, seed=0):
+    """Return the text of a polynomial in x with the given number of
+    terms and random integer coefficients, e.g. "3x^2-5x^1+7x^0".
+    """
+    generator = random.Random(seed)
+    text = ""
+    for power in range(terms-1, -1, -1):
+        coefficient = generator.randint(1, 9)
+        sign = generator.choice(["+", "-"])
+        if text or sign == "-":
+            text += sign
+        text += str(coefficient) + "x^" + str(power)
+    return text
+
+def nested(depth:int):
+    """Return the text of a formula with depth levels of nested
+    parentheses, e.g. "((x+1)*2+1)*2" for a depth of 2.
+    """
+    return "(" * depth + "x" + "+1)*2" * depth
+
+def session(count:int, seed=0):
+    """Return a list of the texts of count formulas, like those a user
+    might have open at once, mixing polynomials, nested parentheses and
+    functions. Some formulas repeat, as they do in real sessions.
+    """
+    generator = random.Random(seed)
+    shapes = [
+        lambda: polynomial(generator.randint(2, 6), generator.random()),
+        lambda: nested(generator.randint(1, 8)),
+        lambda: str(generator.randint(1, 9)) + "sin(x/" +
+            str(generator.randint(1, 9)) + ")",
+        lambda: "sqrt(abs(x))-" + str(generator.randint(1, 9)),
+        lambda: "exp(-x^2/" + str(generator.randint(1, 9)) + ")",
+    ]
+    return [generator.choice(shapes)() for index in range(count)]
+
+def views(steps:int, seed=0):
+    """Return a list of (center, zoom) views visited by panning and
+    zooming around the plane, one step at a time.
+    """
+    generator = random.Random(seed)
+    center = 0
+    zoom = 10
+    visited = []
+    for step in range(steps):
+        if generator.random() < 0.8:
+            center += generator.randint(-5, 5)
+        else:
+            zoom = max(1, zoom + generator.choice([-1, 1]))
+        visited.append((center, zoom))
+    return visited
+
+def drawView(evaluation:scheduler.threadScheduler, formulas:list,
+             center:int, zoom:int):
+    """Calculate every point drawn for the formulas in one view through
+    the sampling module, as graphingCalculator.redrawFormulas does, and
+    return the number of points which would be drawn.
+    """
+    zNums = sampling.viewSamples(-center, zoom, canvasWidth)
+    top = canvasHeight/2/zoom
+    count = 0
+    for values, runs in sampling.sampleFormulas(
+            evaluation, formulas, zNums, -top, top):
+        for start, stop in sampling.finiteRuns(values, runs):
+            count += stop - start
+    return count
+
+def addFormulas(texts:list):
+    """Calculate every point drawn for each formula as it is added, as
+    graphingCalculator.drawFormula does, in the default view.
+    """
+    zNums = sampling.viewSamples(0, 10, canvasWidth)
+    top = canvasHeight/2/10
+    for text in texts:
+        formula = equations.equation(symbolStr=text)
+        values, runs = sampling.sampleFormula(formula, zNums, -top, top)
+        sampling.finiteRuns(values, runs)
+
+def parseFormulas(texts:list):
+    """Parse each of texts from scratch, clearing the parse cache before
+    each one so that repeated texts are parsed again.
+    """
+    formulas = []
+    for text in texts:
+        equations.parsedEquations.clear()
+        formulas.append(equations.equation(symbolStr=text))
+    return formulas
+
+def calculatePoints(text:str, points:int):
+    """Calculate a formula with equation.calculate at points values of
+    x, each one a cache miss.
+    """
+    formula = equations.equation(symbolStr=text)
+    for index in range(points):
+        formula.calculate(x=index/points)
+
+def calculateBound(text:str, points:int):
+    """Calculate a formula at points values of x through the positional
+    function returned by equation.bind.
+    """
+    function = equations.equation(symbolStr=text).bind(("x",))
+    for index in range(points):
+        function(index/points)
+
+def calculateSession(texts:list, points:int):
+    """Calculate every formula of a session together as an
+    equationGroup, as graphingCalculator.redrawFormulas does.
+    """
+    group = equations.equationGroup(
+        [equations.equation(symbolStr=text) for text in texts]
+    )
+    if numpy != None:
+        with numpy.errstate(all="ignore"):
+            group.calculate_array(x=numpy.linspace(-10, 10, points))
+    else:
+        calculate = group.compile()
+        for index in range(points):
+            try:
+                calculate(x=-10 + 20*index/points)
+            except (ArithmeticError, ValueError):
+                pass
+
+def panZoom(texts:list, steps:int):
+    """Draw a session's formulas in each view of a sequence of pans and
+    zooms.
+    """
+    formulas = [equations.equation(symbolStr=text) for text in texts]
+    evaluation = scheduler.threadScheduler()
+    for center, zoom in views(steps):
+        drawView(evaluation, formulas, center, zoom)
+    evaluation.shutdown()
+
+def benchmarks():
+    """Return a dict of the name of each benchmark and a function
+    running it once, building its workload beforehand.
+    """
+    longPolynomial = polynomial(1000)
+    deepNesting = nested(500)
+    formulas = session(200)
+    return {
+        "parse.polynomial.10": lambda: parseFormulas([polynomial(10)]*100),
+        "parse.polynomial.100": lambda: parseFormulas([polynomial(100)]*10),
+        "parse.polynomial.1000": lambda: parseFormulas([longPolynomial]),
+        "parse.nested.500": lambda: parseFormulas([deepNesting]),
+        "parse.session.200": lambda: parseFormulas(formulas),
+        "calculate.polynomial.10": lambda: calculatePoints(
+            polynomial(10), 2000
+        ),
+        "calculate.nested.50": lambda: calculatePoints(nested(50), 2000),
+        "bind.polynomial.10": lambda: calculateBound(polynomial(10), 2000),
+        "calculate.session.200": lambda: calculateSession(formulas, 500),
+        "draw.panZoom.session.20": lambda: panZoom(formulas[:20], 50),
+        "draw.addFormula.session.20": lambda: addFormulas(formulas[:20]),
+    }
+
+def measure(function, repeat:int):
+    """Run a benchmark repeat times and return a dict of its timings in
+    seconds, followed by one more run under tracemalloc recording the
+    peak bytes allocated and the number of memory blocks it left
+    allocated.
+    """
+    seconds = []
+    for index in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    function()
+    after = tracemalloc.take_snapshot()
+    peakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "filename")
+    )
+    return {
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "peakBytes": peakBytes,
+        "blocks": blocks,
+    }
+
+def runBenchmarks(repeat=5, only=None):
+    """Run every benchmark whose name starts with only, or all of them,
+    and return the results as a dict ready to be saved as JSON.
+    """
+    results = {}
+    for name, function in benchmarks().items():
+        if only != None and not name.startswith(only):
+            continue
+        results[name] = measure(function, repeat)
+        print(
+            name.ljust(30), format(results[name]["median"]*1000, ".3f"),
+            "ms", results[name]["peakBytes"], "bytes"
+        )
+    return {
+        "version": resultsVersion,
+        "python": platform.python_version(),
+        "numpy": numpy != None,
+        "benchmarks": results,
+    }
+
+def saveResults(results:dict, path:str):
+    """Write results to a JSON file."""
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+def loadResults(path:str):
+    """Read results written by saveResults from a JSON file."""
+    with open(path) as file:
+        results = json.load(file)
+    if results.get("version") != resultsVersion:
+        raise ValueError(
+            path + " holds results of version " + str(results.get("version"))
+            + ", not " + str(resultsVersion) + "."
+        )
+    return results
+
+def compareResults(results:dict, baseline:dict, threshold=0.1):
+    """Return a list of the names of benchmarks in both results and
+    baseline whose median time or peak memory has grown by more than
+    threshold, as a fraction of the baseline, printing how each one has
+    changed.
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        old = baseline["benchmarks"][name]
+        timeRatio = result["median"]/old["median"] if old["median"] else 1
+        memoryRatio = (
+            result["peakBytes"]/old["peakBytes"] if old["peakBytes"] else 1
+        )
+        regressed = timeRatio > 1 + threshold or memoryRatio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(
+            name.ljust(30), format(timeRatio, ".2f") + "x time",
+            format(memoryRatio, ".2f") + "x memory",
+            "REGRESSION" if regressed else ""
+        )
+    if results["numpy"] != baseline["numpy"]:
+        print("Warning: NumPy was", "installed" if baseline["numpy"]
+              else "not installed", "when the baseline was recorded.")
+    return regressions
+
+def main(arguments=None):
+    """Run the benchmarks from the command line, returning the exit
+    status: 1 if any benchmark regressed against the baseline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="file to write results to")
+    parser.add_argument("--baseline", help="results file to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="fraction by which a benchmark may grow before it regresses"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="prefix of the benchmarks to run")
+    options = parser.parse_args(arguments)
+    results = runBenchmarks(options.repeat, options.only)
+    if options.output != None:
+        saveResults(results, options.output)
+    if options.baseline != None:
+        regressions = compareResults(
+            results, loadResults(options.baseline), options.threshold
+        )
+        if regressions:
+            print(len(regressions), "benchmarks regressed.")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Saves parsed equations to a file and loads them back, so that a
+session with many formulas can start without building and simplifying
+each of them again.
+
+Each equation is stored as a postfix program of its simplified
+expression tree, written with operator and function symbols rather than
+Python functions so that it can be kept as JSON. Files are keyed by
+equations.engineVersion, and files written by another version are
+ignored.
+"""
+
+import json, os
+import equations
+
+# Version of the layout of cache files.
+formatVersion = 2
+
+def serialize(tree):
+    """Return a list of postfix instructions rebuilding an expression
+    tree, each a list starting with its kind: ["number", value],
+    ["variable", name, sign], ["operator", symbol], ["call", name] or
+    ["group", sign].
+    """
+    instructions = []
+    for node in equations.postorder(tree):
+        if type(node) == equations.expression:
+            instructions.append(["operator", node.operator.symbol])
+        elif type(node) == equations.functionCall:
+            instructions.append(["call", node.function.name])
+        elif type(node) == equations.equation:
+            instructions.append(["group", node.sign])
+        elif type(node) == equations.variable:
+            instructions.append(["variable", node.symbol, node.sign])
+        else:
+            instructions.append(["number", node])
+    return instructions
+
+def deserialize(instructions:list, allowed:list):
+    """Return the expression tree built by a list of instructions from
+    serialize, checking that each is well formed and uses only the
+    allowed operators and registered functions. Raises ValueError if
+    they do not describe exactly one tree.
+    """
+    operators = {
+        op.symbol: op
+        for op in equations.operatorOrder(equations.operation, allowed)
+    }
+    stack = []
+    for instruction in instructions:
+        if type(instruction) != list or not instruction:
+            raise ValueError("Malformed instruction " + repr(instruction))
+        kind = instruction[0]
+        if kind == "number" and len(instruction) == 2 and (
+                type(instruction[1]) in [int, float]):
+            stack.append(instruction[1])
+        elif kind == "variable" and len(instruction) == 3 and (
+                type(instruction[1]) == str and instruction[2] in ["", "-"]):
+            stack.append(equations.variable(instruction[1], instruction[2]))
+        elif kind == "operator" and len(instruction) == 2 and (
+                len(stack) > 1 and instruction[1] in operators):
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(equations.expression(
+                operators[instruction[1]], left, right
+            ))
+        elif kind == "call" and len(instruction) == 2 and stack:
+            function = equations.unaryFunction(instruction[1])
+            stack[-1] = equations.functionCall(function, stack[-1])
+        elif kind == "group" and len(instruction) == 2 and stack and (
+                instruction[1] in ["", "-"]):
+            group = equations.equation(
+                allowed=allowed, solutions=equations.disabledCache()
+            )
+            group.tree = stack.pop()
+            group.sign = instruction[1]
+            stack.append(group)
+        else:
+            raise ValueError("Malformed instruction " + repr(instruction))
+    if len(stack) != 1:
+        raise ValueError("Instructions must build exactly one tree.")
+    return stack[0]
+
+def save(path:str):
+    """Write every parsed equation in equations.parsedEquations which
+    uses the default operation class to a cache file, replacing it
+    whole so that a cache file is never left half written.
+    """
+    entries = []
+    for key, (parsed, size) in equations.parsedEquations.entries.items():
+        text, allowed, operator, variableNames = key
+        if operator != equations.operation or parsed.tree == None:
+            continue
+        entries.append({
+            "text": text,
+            "allowed": list(allowed),
+            "variableNames": (
+                None if variableNames == None else list(variableNames)
+            ),
+            "program": serialize(parsed.tree),
+        })
+    contents = {
+        "formatVersion": formatVersion,
+        "engineVersion": equations.engineVersion,
+        "equations": entries,
+    }
+    with open(path + ".tmp", "w") as file:
+        json.dump(contents, file)
+    os.replace(path + ".tmp", path)
+
+def load(path:str):
+    """Read a cache file written by save into equations.parsedEquations,
+    so that parsing any equation in it only tokenizes the text. Entries
+    which fail validation by deserialize are skipped. Returns the number
+    of equations loaded, which is 0 if the file is missing, unreadable
+    or from another version.
+    """
+    try:
+        with open(path) as file:
+            contents = json.load(file)
+    except (OSError, ValueError):
+        return 0
+    if type(contents) != dict or (
+            contents.get("formatVersion") != formatVersion
+            or contents.get("engineVersion") != equations.engineVersion
+            or type(contents.get("equations", [])) != list):
+        return 0
+    count = 0
+    for entry in contents.get("equations", []):
+        try:
+            text = entry["text"]
+            allowed = list(entry["allowed"])
+            if not all(type(symbol) == str for symbol in allowed):
+                continue
+            variableNames = entry["variableNames"]
+            if variableNames != None:
+                variableNames = tuple(variableNames)
+                if not all(type(name) == str for name in variableNames):
+                    continue
+            if type(text) != str:
+                continue
+            parsed = equations.equation(
+                allowed=allowed, solutions=equations.disabledCache()
+            )
+            parsed.tree = deserialize(entry["program"], allowed)
+            parsed.text = text
+        except (KeyError, TypeError, ValueError):
+            continue
+        equations.parsedEquations.put(
+            (text, tuple(allowed), equations.operation, variableNames),
+            parsed
+        )
+        count += 1
+    return count
@@ -3,23 +3,364 @@ strings.
 Designed and coded by Matthew Tien Wells, 2024.
 """
 
+import re, keyword, math
+from math import inf, nextafter
+from array import array
+from collections import OrderedDict, namedtuple
+from functools import partial
+from itertools import islice
+from sys import getsizeof
+from operator import add, mul, sub, truediv
+from types import MappingProxyType
+from time import perf_counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def outward(low:float, high:float):
+    """Return an interval from low to high widened by one floating
+    point step at each end, so that rounding in the calculation of its
+    bounds cannot leave out a true value. Undefined bounds become
+    infinite.
+    """
+    low = -inf if low != low else nextafter(low, -inf)
+    high = inf if high != high else nextafter(high, inf)
+    return (low, high)
+
+def intervalAdd(left:tuple, right:tuple):
+    """Return an interval holding every sum of values in two intervals."""
+    return outward(left[0] + right[0], left[1] + right[1])
+
+def intervalSubtract(left:tuple, right:tuple):
+    """Return an interval holding every difference of values in two
+    intervals.
+    """
+    return outward(left[0] - right[1], left[1] - right[0])
+
+def intervalMultiply(left:tuple, right:tuple):
+    """Return an interval holding every product of values in two
+    intervals.
+    """
+    # 0 times infinity is taken to be 0, as the bounds are limits.
+    products = [a*b if a*b == a*b else 0.0 for a in left for b in right]
+    return outward(min(products), max(products))
+
+def intervalDivide(left:tuple, right:tuple):
+    """Return an interval holding every quotient of values in two
+    intervals, which is unbounded if the divisor may be 0.
+    """
+    if right[0] <= 0 <= right[1]:
+        return (-inf, inf)
+    return intervalMultiply(left, (1/right[1], 1/right[0]))
+
+def intervalPower(left:tuple, right:tuple):
+    """Return an interval holding every power of a value in the left
+    interval to a value in the right. Unbounded unless the exponent is a
+    single integer or the base is positive, since negative bases to
+    fractional powers are not real numbers.
+    """
+    def power(base, exponent):
+        try:
+            return float(base) ** exponent
+        except OverflowError:
+            return -inf if base < 0 and exponent % 2 == 1 else inf
+
+    low, high = left
+    if right[0] == right[1] and float(right[0]).is_integer():
+        exponent = int(right[0])
+        if exponent == 0:
+            return (1.0, 1.0)
+        if exponent < 0:
+            return intervalDivide(
+                (1.0, 1.0), intervalPower(left, (-exponent, -exponent))
+            )
+        if exponent % 2 == 1 or low >= 0:
+            return outward(power(low, exponent), power(high, exponent))
+        if high <= 0:
+            return outward(power(high, exponent), power(low, exponent))
+        return outward(0.0, max(power(low, exponent), power(high, exponent)))
+    if low > 0:
+        # Positive powers are monotonic in both the base and exponent,
+        # so the bounds are among the corners.
+        corners = [power(a, b) for a in left for b in right]
+        return outward(min(corners), max(corners))
+    return (-inf, inf)
+
+def intervalExp(argument:tuple):
+    """Return an interval holding the exponential of every value in an
+    interval.
+    """
+    def exponential(value):
+        try:
+            return math.exp(value)
+        except OverflowError:
+            return inf
+
+    return outward(exponential(argument[0]), exponential(argument[1]))
+
+def intervalLog(argument:tuple):
+    """Return an interval holding the natural logarithm of every value
+    in an interval, which is unbounded unless every value is positive.
+    """
+    if argument[0] > 0:
+        return outward(math.log(argument[0]), math.log(argument[1]))
+    return (-inf, inf)
+
+def intervalSqrt(argument:tuple):
+    """Return an interval holding the square root of every value in an
+    interval, which is unbounded unless no value is negative.
+    """
+    if argument[0] >= 0:
+        return outward(math.sqrt(argument[0]), math.sqrt(argument[1]))
+    return (-inf, inf)
+
+def intervalAbs(argument:tuple):
+    """Return an interval holding the absolute value of every value in
+    an interval.
+    """
+    low, high = argument
+    if low >= 0:
+        return (low, high)
+    if high <= 0:
+        return (-high, -low)
+    return (0.0, max(-low, high))
+
+def intervalPeriodic(function, argument:tuple, peak:float):
+    """Return an interval holding every value of sin or cos, given as
+    function, over an interval, where peak is the x of one of its maxima
+    of 1. Its minima of -1 are half a period from its maxima. Maxima
+    and minima within rounding error of the interval are counted as in
+    it.
+    """
+    low, high = argument
+    if not high - low < 2*math.pi:
+        return (-1.0, 1.0)
+    slack = 1e-9*max(1, abs(low), abs(high))
+    values = [function(low), function(high)]
+    for extreme, value in [(peak, 1.0), (peak + math.pi, -1.0)]:
+        turns = math.ceil((low - slack - extreme)/(2*math.pi))
+        if extreme + 2*math.pi*turns <= high + slack:
+            values.append(value)
+    low, high = outward(min(values), max(values))
+    return (max(low, -1.0), min(high, 1.0))
+
+def intervalSin(argument:tuple):
+    """Return an interval holding the sine of every value in an
+    interval.
+    """
+    return intervalPeriodic(math.sin, argument, math.pi/2)
+
+def intervalCos(argument:tuple):
+    """Return an interval holding the cosine of every value in an
+    interval.
+    """
+    return intervalPeriodic(math.cos, argument, 0.0)
+
+def intervalTan(argument:tuple):
+    """Return an interval holding the tangent of every value in an
+    interval, which is unbounded if it may hold one of the asymptotes.
+    """
+    low, high = argument
+    if not high - low < math.pi:
+        return (-inf, inf)
+    slack = 1e-9*max(1, abs(low), abs(high))
+    turns = math.ceil((low - slack - math.pi/2)/math.pi)
+    if math.pi/2 + math.pi*turns <= high + slack:
+        return (-inf, inf)
+    return outward(math.tan(low), math.tan(high))
+
+def numpyKernel(name:str):
+    """Return the NumPy function of a name, or None if NumPy is not
+    installed.
+    """
+    if numpy == None:
+        return None
+    return getattr(numpy, name)
+
+def maskedDivide(left:float|int, right:float|int):
+    """Divide two numbers, giving an infinity of the right sign when
+    dividing by zero, or nan for 0/0, rather than raising.
+    """
+    try:
+        return left / right
+    except ZeroDivisionError:
+        if left == 0 or left != left:
+            return math.nan
+        return math.copysign(inf, left) * math.copysign(1, right)
+    except OverflowError:
+        return inf if (left > 0) == (right > 0) else -inf
+
+def maskedPower(left:float|int, right:float|int):
+    """Raise one number to the power of another, giving nan where the
+    result is not a real number and infinity where it is too large,
+    rather than raising or returning a complex number.
+    """
+    try:
+        value = left ** right
+    except ZeroDivisionError:
+        # Odd powers keep the sign of the zero, so (-0.0)^-1 is -inf.
+        if float(right).is_integer() and right % 2 == 1:
+            return math.copysign(inf, left)
+        return inf
+    except OverflowError:
+        if left < 0 and float(right).is_integer() and right % 2 == 1:
+            return -inf
+        return inf
+    if type(value) == complex:
+        return math.nan
+    return value
+
+def maskedExp(argument:float|int):
+    """Return the exponential of a number, or infinity if it is too
+    large to represent, rather than raising.
+    """
+    try:
+        return math.exp(argument)
+    except OverflowError:
+        return inf
+
+def maskedLog(argument:float|int):
+    """Return the natural logarithm of a number, -inf for 0 and nan for
+    negative numbers, rather than raising.
+    """
+    if argument == 0:
+        return -inf
+    if not argument > 0:
+        return math.nan
+    return math.log(argument)
+
+def maskedCall(function):
+    """Return a function calling function which gives nan, rather than
+    raising, wherever function raises an arithmetic or domain error.
+    """
+    def masked(*arguments):
+        try:
+            return function(*arguments)
+        except (ArithmeticError, ValueError):
+            return math.nan
+    return masked
+
+def realArray(values, shape):
+    """Return a float array of the given shape from the values given by
+    a function compiled with kernels, with nan wherever a value is
+    complex, as a kernel registered by extendCalculate may give.
+    """
+    values = numpy.broadcast_to(values, shape)
+    if numpy.iscomplexobj(values):
+        values = numpy.where(values.imag == 0, values.real, numpy.nan)
+    return values.astype(float)
+
+# Definition of an operator: its default place in the order of
+# operations (lower is applied first), whether a chain of it groups
+# from the "left" or "right", a function applying it to two numbers, a
+# kernel applying it to two NumPy arrays, and a function applying it to
+# two (low, high) intervals, either of which may be None.
+operatorDefinition = namedtuple(
+    "operatorDefinition",
+    ["precedence", "associativity", "function", "kernel", "interval"]
+)
+
+# Every operator known to equations, by symbol. Replaced rather than
+# modified by registerOperator, so it can be shared freely.
+operatorRegistry = MappingProxyType({
+    "^": operatorDefinition(0, "left", pow, pow, intervalPower),
+    "*": operatorDefinition(1, "left", mul, mul, intervalMultiply),
+    "/": operatorDefinition(2, "left", truediv, truediv, intervalDivide),
+    "+": operatorDefinition(3, "left", add, add, intervalAdd),
+    "-": operatorDefinition(4, "left", sub, sub, intervalSubtract),
+})
+
+# Definition of a function of one number: a function applying it to a
+# number, a kernel applying it to a NumPy array and a function applying
+# it to a (low, high) interval, the last two of which may be None.
+functionDefinition = namedtuple(
+    "functionDefinition", ["function", "kernel", "interval"]
+)
+
+# Every function equations may call, by name, e.g. sin(x). Replaced
+# rather than modified by registerFunction, so it can be shared freely.
+functionRegistry = MappingProxyType({
+    "sin": functionDefinition(math.sin, numpyKernel("sin"), intervalSin),
+    "cos": functionDefinition(math.cos, numpyKernel("cos"), intervalCos),
+    "tan": functionDefinition(math.tan, numpyKernel("tan"), intervalTan),
+    "exp": functionDefinition(math.exp, numpyKernel("exp"), intervalExp),
+    "log": functionDefinition(math.log, numpyKernel("log"), intervalLog),
+    "sqrt": functionDefinition(math.sqrt, numpyKernel("sqrt"), intervalSqrt),
+    "abs": functionDefinition(abs, numpyKernel("abs"), intervalAbs),
+})
+
+# Named constants, replaced by their values when equations are parsed.
+constants = {"pi": math.pi, "e": math.e}
+
+# Versions of operators and functions which give nan or infinity for
+# errors rather than raising, used by equation.compileMasked. Others are
+# wrapped by maskedCall, except the Python operators +, - and *, which
+# cannot raise for floats.
+maskedFunctions = {
+    "/": maskedDivide, "^": maskedPower, "exp": maskedExp, "log": maskedLog,
+}
+
+# Python operators used by compiled functions for the arithmetic
+# operators, in place of calling their functions.
+infixOperators = {"^": "**", "*": "*", "/": "/", "+": "+", "-": "-"}
+
+# Version of the parser, simplifier and expression tree, to be raised
+# whenever a change to them would give a saved tree a different
+# meaning, so that trees saved by equationCache are not reused.
+engineVersion = 2
+
 # Legal calculation operations in the order they should be applied.
 allowedOperations = ["^","*","/","+","-"]
 
+# Shared order of operations for each operator class and list of
+# allowed operations, so that equations do not create their own.
+operatorOrders = {}
+
 
 class operation:
     """Class representing a single mathematical operation that takes
     two inputs and produces one output. By default only supports the 
     operators in allowedOperations, but any class inheriting from this
     may override the extendCalculate method to allow additional
-    operations.
+    operations. Operators in operatorRegistry are calculated with the
+    function and kernel registered for them. Instances are flyweights:
+    creating an operation returns the one instance of its class for
+    that symbol.
     """
+    __slots__ = ("symbol", "associativity", "function", "kernel", "interval")
+    # The shared instance for each class and symbol.
+    interned = {}
+
+    def __new__(cls, symbol:str, *args, **kwargs):
+        key = (cls, symbol)
+        instance = operation.interned.get(key)
+        if instance == None:
+            instance = super().__new__(cls)
+            operation.interned[key] = instance
+        return instance
+
+    def __getnewargs__(self):
+        return (self.symbol,)
+
     def __init__(self, symbol:str, allowed=allowedOperations):
         if symbol not in allowed:
             raise ValueError(
                 symbol + " is not a supported mathematical operator."
             )
         self.symbol = symbol
+        definition = operatorRegistry.get(symbol)
+        if definition != None:
+            self.associativity = definition.associativity
+            self.function = definition.function
+            self.kernel = definition.kernel
+            self.interval = definition.interval
+        else:
+            self.associativity = "left"
+            self.function = self.extendCalculate
+            self.kernel = None
+            self.interval = None
 
     def __str__(self):
         return self.symbol
@@ -28,18 +369,7 @@ class operation:
         """Calculate the result of applying this operation to variable
         left with variable right as input.
         """
-        if self.symbol == "+":
-            return left+right
-        elif self.symbol == "-":
-            return left-right
-        elif self.symbol == "/":
-            return left/right
-        elif self.symbol == "*":
-            return left*right
-        elif self.symbol == "^":
-            return left**right
-        else:
-            return self.extendCalculate(left, right)
+        return self.function(left, right)
 
     def extendCalculate(self, left:float|int, right:float|int):
         """Provides additional operations to calculate. By default this
@@ -49,187 +379,1697 @@ class operation:
         """
         pass
 
+class unaryFunction:
+    """Class representing a named mathematical function of one number,
+    such as sin, calculated with the function and kernel registered for
+    it in functionRegistry. Instances are flyweights: creating a
+    unaryFunction returns the one instance of its class for that name.
+    """
+    __slots__ = ("name", "function", "kernel", "interval")
+    # The shared instance for each class and name.
+    interned = {}
+
+    def __new__(cls, name:str):
+        key = (cls, name)
+        instance = unaryFunction.interned.get(key)
+        if instance == None:
+            instance = super().__new__(cls)
+            unaryFunction.interned[key] = instance
+        return instance
+
+    def __getnewargs__(self):
+        return (self.name,)
+
+    def __init__(self, name:str):
+        definition = functionRegistry.get(name)
+        if definition == None:
+            raise ValueError(
+                name + " is not a supported mathematical function."
+            )
+        self.name = name
+        self.function = definition.function
+        self.kernel = definition.kernel
+        self.interval = definition.interval
+
+    def __str__(self):
+        return self.name
+
+    def calculate(self, argument:float|int):
+        """Calculate the result of applying this function to argument."""
+        return self.function(argument)
+
+class functionCall:
+    """A function applied to an argument, making up one node of an
+    equation's expression tree. The argument may be a number, a
+    variable, a subequation or an expression.
+    """
+    __slots__ = ("function", "argument")
+
+    def __init__(self, function:unaryFunction, argument):
+        self.function = function
+        self.argument = argument
+
+    def __str__(self):
+        return formatTree(self)
+
+class expression:
+    """A single operation applied to a left and a right operand, making
+    up one node of an equation's expression tree. Each operand may be a
+    number, a variable, a subequation or another expression.
+    """
+    __slots__ = ("operator", "left", "right")
+
+    def __init__(self, operator:operation, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def __str__(self):
+        return formatTree(self)
+
+class program:
+    """A flat postfix (reverse Polish) program calculating an equation,
+    run on a small stack machine. Each instruction is an opcode in
+    self.codes with a matching argument in self.arguments: a number to
+    push, a variable name to look up, or a function applying an
+    operator to the top two values or a function to the top value.
+    Contains only numbers, strings and functions, so it can be pickled.
+    """
+    # Opcodes
+    CONSTANT = 0
+    VARIABLE = 1
+    NEGATE = 2
+    OPERATOR = 3
+    CALL = 4
+
+    def __init__(self):
+        self.codes = array("B")
+        self.arguments = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, code:int, argument=None):
+        """Add an instruction to the end of the program."""
+        self.codes.append(code)
+        self.arguments.append(argument)
+
+    def calculate(self, **kwargs):
+        """Run the program with a float or integer value for each
+        variable and return the result.
+        """
+        stack = []
+        for code, argument in zip(self.codes, self.arguments):
+            if code == program.OPERATOR:
+                right = stack.pop()
+                stack[-1] = argument(stack[-1], right)
+            elif code == program.CONSTANT:
+                stack.append(argument)
+            elif code == program.VARIABLE:
+                stack.append(kwargs[argument])
+            elif code == program.CALL:
+                stack[-1] = argument(stack[-1])
+            else:
+                stack[-1] = -stack[-1]
+        return stack[0]
+
+class lruCache:
+    """A least recently used cache, holding at most maxEntries entries
+    and, if maxBytes is given, roughly that many bytes of keys and
+    values. Records how many lookups were hits and misses and how many
+    entries have been evicted to stay within its limits. Sizes are only
+    measured when maxBytes is given, since measuring them costs more
+    than storing the entry, so otherwise bytes stays 0.
+    """
+    def __init__(self, maxEntries=4096, maxBytes=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        # Maps each key to a tuple of its value and approximate size.
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the value stored under key, marking it as the most
+        recently used, or None if there is no such entry.
+        """
+        entry = self.entries.get(key)
+        if entry == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used
+        entries if the cache is over either of its limits.
+        """
+        if self.maxBytes == None:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.entries[key] = (value, 0)
+            if len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return None
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        size = entrySize(key, value)
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while len(self.entries) > self.maxEntries or (
+                self.bytes > self.maxBytes):
+            self.bytes -= self.entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every entry, keeping the counters."""
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Return the cache's size, limits and counters as a dict."""
+        return {
+            "entries": len(self.entries), "maxEntries": self.maxEntries,
+            "bytes": self.bytes, "maxBytes": self.maxBytes,
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class disabledCache(lruCache):
+    """A cache which never stores anything, for equations whose
+    solutions are not worth keeping. Lookups are still counted.
+    """
+    def __init__(self):
+        super().__init__(maxEntries=0)
+
+    def put(self, key, value):
+        pass
+
+class metricsRecorder:
+    """Counts and times the work done by equations, so that the
+    formulas which take the most time and how often their caches are
+    hit can be seen from a running process. Counters and timers are
+    kept per equation, named by its text in parentheses, and per
+    operator or function symbol for kernels.
+    Recording only happens while the recorder is the module's metrics,
+    set with enableMetrics.
+    """
+    enabled = True
+
+    def __init__(self):
+        # Maps each (name, event) pair to its count or total seconds.
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name:str, event:str, amount=1):
+        """Add amount to the counter of an event for a name."""
+        key = (name, event)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def addTime(self, name:str, event:str, seconds:float):
+        """Add seconds to the timer of an event for a name."""
+        key = (name, event)
+        self.timers[key] = self.timers.get(key, 0.0) + seconds
+
+    def clear(self):
+        """Reset every counter and timer."""
+        self.counters.clear()
+        self.timers.clear()
+
+    def report(self):
+        """Return a dict mapping each name to a dict of its counters and
+        timers, with timers given in seconds under the event name
+        followed by "Seconds". Names are ordered by their total time,
+        longest first.
+        """
+        report = {}
+        for (name, event), value in self.counters.items():
+            report.setdefault(name, {})[event] = value
+        for (name, event), value in self.timers.items():
+            report.setdefault(name, {})[event + "Seconds"] = value
+        def totalSeconds(name):
+            return sum(
+                value for (other, event), value in self.timers.items()
+                if other == name
+            )
+        return {name: report[name] for name in sorted(
+            report, key=totalSeconds, reverse=True
+        )}
+
+class disabledMetrics(metricsRecorder):
+    """A metrics recorder which records nothing, used while metrics are
+    disabled. Equations check enabled before timing anything, so that
+    disabled metrics cost one attribute lookup.
+    """
+    enabled = False
+
+    def count(self, name, event, amount=1):
+        pass
+
+    def addTime(self, name, event, seconds):
+        pass
+
+# Metrics recorded by every equation, replaced by enableMetrics and
+# disableMetrics.
+metrics = disabledMetrics()
+
+# Called with no arguments to create the solution cache of each new
+# equation. Replace it to change the policy globally, e.g. with
+# partial(lruCache, maxBytes=2**20) or disabledCache.
+solutionCachePolicy = partial(lruCache, maxEntries=4096)
+
+# Parsed equations shared by the whole process, keyed by normalized
+# formula text.
+parsedEquations = lruCache(maxEntries=1024)
+
 class equation:
     """A mathematical equation using the operations defined in
     allowedOperations. Additional operations can be added by passing in
     a child class of operation as 'operator' and custom list of
-    allowedOperations as 'allowed'.
+    allowedOperations as 'allowed'. The parsed equation is held as an
+    expression tree in self.tree, in which parenthesized subequations
+    are themselves equations. Solutions are kept in 'solutions', a
+    cache created by solutionCachePolicy unless one is passed in.
+    Variables are single letters unless a list of their names is passed
+    as 'variableNames', in which case names may be several letters long,
+    e.g. equation(symbolStr="theta x", variableNames=["theta", "x"]).
+    The functions in functionRegistry, such as sin(x), and the
+    constants pi and e may also be used.
     """
     def __init__(
             self, color='black', symbolStr=None, allowed=allowedOperations,
-            operator=operation,
+            operator=operation, solutions=None, variableNames=None,
         ):
         self.allowed = allowed
-        self.order = [operator(op) for op in allowed]
-        self.symbols = []
-        self.solutions = {}
+        if variableNames != None:
+            for name in variableNames:
+                if not re.fullmatch(r"[^\W\d]+", name):
+                    raise ValueError(
+                        "Variable names must be made of letters, not "
+                        + repr(name) + "."
+                    )
+            variableNames = tuple(variableNames)
+        self.variableNames = variableNames
+        self.operator = operator
+        self.order = operatorOrder(operator, allowed)
+        self.tree = None
+        self.text = None
+        self.sign = ""
+        if solutions == None:
+            solutions = solutionCachePolicy()
+        self.solutions = solutions
+        self.compiled = None
+        self.compiledArray = None
+        self.timedArray = None
+        self.compiledMasked = None
+        self.program = None
+        self.maskedProgram = None
+        self.bound = {}
+        self.parsed = None
         if symbolStr != None:
             self.parse(symbolStr)
         self.color = color
 
     def __str__(self):
-        return "(" + "".join(str(symbol) for symbol in self.symbols) + ")"
-    
-    def __append__(self, symbol):
-        self.symbols.append(symbol)
+        if self.text != None:
+            return "(" + self.text + ")"
+        if self.tree == None:
+            return "()"
+        return self.sign + "(" + formatTree(self.tree, self.order) + ")"
 
     def parse(self, symbolStr: str):
         """Read a string into an equation, replacing the existing
-        equation if one exists.
-        """
-        self.symbols = []
-        self.solutions = {}
-        number = None
-        subequation = 0
-        subequationString = ""
-        for char in symbolStr:
-            # If reading from open parentheses, read until the
-            # parentheses are balanced and treat the read text as its
-            # own equation, parsing it recursively.
-            if subequation > 0:
-                if char == "(":
-                    subequation += 1
-                elif char == ")":
-                    subequation -= 1
-                if subequation > 0:
-                    subequationString += char
-                else:
-                    self.__append__(
-                        equation(allowed=self.allowed).parse(subequationString)
+        equation if one exists. Equations which normalize to the same
+        text share one parsed tree, postfix program and compiled
+        function through parsedEquations, so each is only built once.
+        """
+        if metrics.enabled:
+            start = perf_counter()
+        tokens = tokenize(symbolStr, self.allowed, self.variableNames)
+        self.text = "".join(text for kind, text in tokens)
+        self.tree = None
+        self.solutions.clear()
+        self.compiled = None
+        self.compiledArray = None
+        self.timedArray = None
+        self.compiledMasked = None
+        self.program = None
+        self.maskedProgram = None
+        self.bound = {}
+        self.parsed = None
+        if not tokens:
+            return self
+        # Declared variable names are part of the key, since a name
+        # such as pi may be a variable in one equation and a constant
+        # in another with the same text.
+        key = (
+            normalize(tokens), tuple(self.allowed), self.operator,
+            self.variableNames
+        )
+        parsed = parsedEquations.get(key)
+        if metrics.enabled:
+            metrics.count(str(self), "parses")
+            metrics.count(
+                str(self),
+                "parseCacheMisses" if parsed == None else "parseCacheHits"
+            )
+        if parsed == None:
+            parsed = equation(
+                allowed=self.allowed, operator=self.operator,
+                solutions=disabledCache(),
+            )
+            parsed.tree = parsed.simplify(parsed.build(tokens))
+            parsed.text = key[0]
+            parsedEquations.put(key, parsed)
+        self.tree = parsed.tree
+        self.parsed = parsed
+        if metrics.enabled:
+            metrics.addTime(str(self), "parse", perf_counter() - start)
+        return self
+
+    def build(self, tokens:list):
+        """Build a list of tokens into an expression tree and return
+        it. The tree is built in a single pass using explicit stacks, so
+        deeply nested parentheses are neither rescanned nor limited by
+        the recursion limit. Implicit multiplication and negative signs
+        are resolved here rather than when calculating.
+        """
+        operators = {op.symbol: op for op in self.order}
+        precedence = {op.symbol: index for index, op in enumerate(self.order)}
+        operands = []
+        # Operators waiting for their right operand, and open
+        # parentheses, recorded as a tuple of the sign to apply to their
+        # contents and the function they are the argument of, if any.
+        pending = []
+        # A function whose open parenthesis is the next token.
+        calling = None
+
+        def reduce():
+            op = pending.pop()
+            right = operands.pop()
+            left = operands.pop()
+            operands.append(expression(op, left, right))
+
+        def push(symbol):
+            if symbol not in operators:
+                raise ValueError(
+                    symbol + " is not a supported mathematical operator."
+                )
+            # Apply waiting operators that come before this one in the
+            # order of operations, or alongside it further left if it
+            # groups from the left.
+            op = operators[symbol]
+            while pending and type(pending[-1]) != tuple and (
+                    precedence[pending[-1].symbol] < precedence[symbol]
+                    or (pending[-1].symbol == symbol
+                        and op.associativity == "left")):
+                reduce()
+            pending.append(op)
+
+        expectOperand = True
+        sign = ""
+        for kind, text in tokens:
+            if calling != None and text != "(":
+                raise ValueError(
+                    "Function " + calling.name + " must be followed by an "
+                    "open parenthesis."
+                )
+            if not expectOperand:
+                if kind == "operator":
+                    push(text)
+                    expectOperand = True
+                    continue
+                elif text == ")":
+                    while pending and type(pending[-1]) != tuple:
+                        reduce()
+                    if not pending:
+                        raise ValueError(
+                            "Close parenthesis must come after an open "
+                            "parenthesis"
+                        )
+                    parenSign, called = pending.pop()
+                    tree = operands.pop()
+                    if called != None:
+                        tree = functionCall(called, tree)
+                    if called == None or parenSign == "-":
+                        subequation = equation(
+                            allowed=self.allowed, operator=self.operator,
+                            solutions=disabledCache(),
+                        )
+                        subequation.tree = tree
+                        subequation.sign = parenSign
+                        tree = subequation
+                    operands.append(tree)
+                    continue
+                # A number, variable or parenthesis directly after
+                # another operand is multiplied by it.
+                push("*")
+                expectOperand = True
+            if kind == "operator":
+                if text != "-":
+                    raise ValueError(
+                        "Operator " + text + " must follow a number, "
+                        "variable or close parenthesis."
                     )
-                    subequationString = ""
+                if sign == "-":
+                    raise ValueError("Operator - may not follow a -.")
+                sign = "-"
                 continue
-            # handle minus signs after other operators as part of a
-            # negative number
-            if char == "-" and number == None:
-                number = "-"
+            if kind == "number":
+                value = float(text) if "." in text else int(text)
+                operands.append(-value if sign == "-" else value)
+            elif kind == "name":
+                operands.append(variable(text, sign=sign))
+            elif kind == "constant":
+                value = constants[text]
+                operands.append(-value if sign == "-" else value)
+            elif kind == "function":
+                # The sign applies to the call, once its parenthesis is
+                # read.
+                calling = unaryFunction(text)
                 continue
-            # If the character is not part of a number, parse any digits
-            # we've just read as a number and append it to the symbols.
-            # If it is part of a number, record it as part of a string.
-            if char not in "0123456789.":
-                if number != None:
-                    if '.' in number:
-                        self.__append__(float(number))
-                        number = None
-                    elif number == "-":
-                        pass
-                    else:
-                        self.__append__(int(number))
-                        number = None
-            elif number == None:
-                number = char
-            else:
-                number = number+char
-            # Record operators as instances of the operator class.
-            if char in self.allowed:
-                if number == "-":
-                    raise ValueError(
-                        "Operator " + char + " may not follow a -."
-                    )
-                self.__append__(operation(char))
+            elif text == "(":
+                pending.append((sign, calling))
+                sign = ""
+                calling = None
                 continue
-            if char not in "0123456789.":
-                # If the character is an open parenthesis, begin reading
-                # as a subequation.
-                if char == "(":
-                    subequation = 1
-                    continue
-                elif char == ")":
-                    raise ValueError(
-                        "Close parenthesis must come after an open parenthesis"
+            else:
+                raise ValueError("Equations must end with a number or variable.")
+            sign = ""
+            expectOperand = False
+        if expectOperand:
+            raise ValueError("Equations must end with a number or variable.")
+        while pending:
+            if type(pending[-1]) == tuple:
+                raise ValueError("Open parenthesis must be closed.")
+            reduce()
+        return operands.pop()
+
+    def simplify(self, tree):
+        """Simplify an expression tree in place and return its new root.
+        Operations on two numbers are folded into one number, constants
+        are gathered together along chains of additions, subtractions
+        and multiplications, functions of numbers are calculated,
+        identities such as *1, +0 and ^1 are removed, and parentheses
+        around single terms are dropped.
+        Only the arithmetic operators in infixOperators are simplified.
+        """
+        operators = {op.symbol: op for op in self.order}
+        results = []
+        for node in postorder(tree):
+            if type(node) == expression:
+                node.right = results.pop()
+                node.left = results.pop()
+                results.append(simplifyExpression(node, operators))
+            elif type(node) == functionCall:
+                node.argument = results.pop()
+                value = None
+                if type(node.argument) in [int, float]:
+                    value = foldFunction(node.function, node.argument)
+                results.append(node if value == None else value)
+            elif type(node) == equation:
+                inner = results.pop()
+                if type(inner) in [int, float]:
+                    results.append(-inner if node.sign == "-" else inner)
+                elif type(inner) == variable:
+                    results.append(
+                        variable(inner.symbol, combineSigns(inner, node))
                     )
-                # Ignore spaces
-                elif char == " ":
-                    continue
-                # Treat any still unhandled characters as a variable
-                # name.
+                elif type(inner) == equation:
+                    inner.sign = combineSigns(inner, node)
+                    results.append(inner)
                 else:
-                    if number == "-":
-                        self.__append__(variable(char,sign="-"))
-                        number = None
-                    else:
-                        self.__append__(variable(char))
-        if number != None:
-            if '.' in number:
-                self.__append__(float(number))
+                    node.tree = inner
+                    results.append(node)
             else:
-                self.__append__(int(number))
+                results.append(node)
+        tree = results[0]
+        # Parentheses around the whole equation change nothing.
+        if type(tree) == equation and tree.sign == "":
+            tree = tree.tree
+        return tree
+
+    def simplified(self):
+        """Return the text of the equation as it is calculated, after
+        the simplification applied when it was parsed.
+        """
+        if self.tree == None:
+            return ""
+        return formatTree(self.tree, self.order)
 
-    
     def calculate(self, **kwargs):
         """Calculate the value of the equation given a float or integer
-        value for each variable in symbols. Calls itself recursively if
-        any symbols in the equation are subequations. Obeys the order
-        of operations in self.order.
+        value for each variable in the tree, by running the postfix
+        program returned by lower.
         """
-        notOperator = False
-        values = []
-        operations = []
-        solutionKey = tuple((key, kwargs[key]) for key in sorted(kwargs))
-        if solutionKey in self.solutions.keys():
-            return self.solutions[solutionKey]
-        #Seperate values from operators
-        for symbol in self.symbols:
-            if type(symbol) == equation:
-                values.append(symbol.calculate(kwargs=kwargs))
-            elif type(symbol) in [int, float]:
-                values.append(symbol)
-            elif type(symbol) == variable:
-                value = kwargs[symbol.symbol]
-                if symbol.sign == "-":
-                    value *= -1
-                values.append(value)
-            
-            if notOperator and type(symbol) != operation:
-                operations.append(operation("*"))
-            
-            if type(symbol) == operation:
-                operations.append(symbol)
-                notOperator = False
-            else:
-                notOperator = True
-        if len(values) != len(operations)+1:
-            print(values)
-            print([str(op) for op in operations])
-            raise ValueError("Equations must end with a number or variable.")
-        #Iterate through operators in the order of self.order,
-        #collapsing values together for each operation.
-        for operatorType in self.order:
-            opIndex = 0
-            finishedOps = []
-            for op in operations:
-                if op.symbol == operatorType.symbol:
-                    values = values[:opIndex] + [
-                        op.calculate(values[opIndex],values[opIndex+1])
-                    ] + values[opIndex+2:]
-                    finishedOps.append(op)
+        if metrics.enabled:
+            start = perf_counter()
+        solutionKey = tuple(sorted(kwargs.items()))
+        solution = self.solutions.get(solutionKey)
+        if metrics.enabled:
+            metrics.count(str(self), "evaluations")
+            metrics.count(
+                str(self),
+                "solutionCacheMisses" if solution == None
+                else "solutionCacheHits"
+            )
+        if solution == None:
+            solution = self.lower().calculate(**kwargs)
+            self.solutions.put(solutionKey, solution)
+        if metrics.enabled:
+            metrics.addTime(str(self), "calculate", perf_counter() - start)
+        return solution
+
+    def lower(self, masked=False):
+        """Lower the expression tree into a postfix program, which
+        calculates the equation in a single linear pass without walking
+        the tree. If masked is True, the program calculates the
+        equation as calculate_masked does, applying maskedFunctions and
+        maskedCall and holding every constant as a float. Each program
+        is cached until the equation is next parsed.
+        """
+        lowered = self.maskedProgram if masked else self.program
+        if lowered == None and self.parsed != None:
+            lowered = self.parsed.lower(masked)
+        if lowered == None:
+            if self.tree == None:
+                raise ValueError(
+                    "Equations must end with a number or variable."
+                )
+            lowered = program()
+            for node in postorder(self.tree):
+                if type(node) == expression:
+                    function = node.operator.function
+                    if masked and node.operator.symbol not in ["+", "-", "*"]:
+                        function = maskedFunctions.get(
+                            node.operator.symbol, maskedCall(function)
+                        )
+                    lowered.append(program.OPERATOR, function)
+                elif type(node) == functionCall:
+                    function = node.function.function
+                    if masked:
+                        function = maskedFunctions.get(
+                            node.function.name, maskedCall(function)
+                        )
+                    lowered.append(program.CALL, function)
+                elif type(node) == equation:
+                    if node.sign == "-":
+                        lowered.append(program.NEGATE)
+                elif type(node) == variable:
+                    lowered.append(program.VARIABLE, node.symbol)
+                    if node.sign == "-":
+                        lowered.append(program.NEGATE)
+                elif masked:
+                    lowered.append(program.CONSTANT, floatConstant(node))
                 else:
-                    opIndex += 1
-                
-            for op in finishedOps:
-                operations.remove(op)
-        self.solutions[solutionKey] = values[0]
-        return values[0]
+                    lowered.append(program.CONSTANT, node)
+        if masked:
+            self.maskedProgram = lowered
+        else:
+            self.program = lowered
+        return lowered
     
     def getSolution(self, **kwargs):
         """Check for a cached solution for the equation with the given
         variables and return it. If it does not exist, return None.
         """
-        solutionKey = tuple((key, kwargs[key]) for key in sorted(kwargs))
-        if solutionKey in self.solutions.keys():
-            return self.solutions[solutionKey]
+        solutionKey = tuple(sorted(kwargs.items()))
+        return self.solutions.get(solutionKey)
+
+    def variables(self):
+        """Return the set of variable names used anywhere in the
+        equation, including in its subequations.
+        """
+        names = set()
+        if self.tree != None:
+            for node in postorder(self.tree):
+                if type(node) == variable:
+                    names.add(node.symbol)
+        return names
+
+    def vectorizable(self):
+        """Return whether every operator and function in the equation,
+        including in its subequations, has a kernel and can therefore be
+        applied to whole NumPy arrays at once.
+        """
+        if self.tree != None:
+            for node in postorder(self.tree):
+                if type(node) == expression:
+                    if node.operator.kernel == None:
+                        return False
+                elif type(node) == functionCall:
+                    if node.function.kernel == None:
+                        return False
+        return True
+
+    def calculate_interval(self, **intervals):
+        """Return a (low, high) interval guaranteed to hold every value
+        the equation takes when each variable is anywhere within a
+        (low, high) interval, e.g. equation.calculate_interval(x=(0, 1)).
+        Variables may also be given single numbers. The interval may be
+        wider than the true range of values, and is unbounded wherever
+        an operator or function without an interval function is
+        applied.
+        """
+        if self.tree == None:
+            raise ValueError("Equations must end with a number or variable.")
+        values = []
+        for node in postorder(self.tree):
+            if type(node) == expression:
+                right = values.pop()
+                if node.operator.interval == None:
+                    values[-1] = (-inf, inf)
+                else:
+                    values[-1] = node.operator.interval(values[-1], right)
+            elif type(node) == functionCall:
+                if node.function.interval == None:
+                    values[-1] = (-inf, inf)
+                else:
+                    values[-1] = node.function.interval(values[-1])
+            elif type(node) == equation:
+                if node.sign == "-":
+                    low, high = values[-1]
+                    values[-1] = (-high, -low)
+            elif type(node) == variable:
+                value = intervals[node.symbol]
+                if type(value) == tuple:
+                    low, high = min(value), max(value)
+                else:
+                    low = high = value
+                if node.sign == "-":
+                    low, high = -high, -low
+                values.append((float(low), float(high)))
+            else:
+                try:
+                    values.append((float(node), float(node)))
+                except OverflowError:
+                    values.append((inf, inf) if node > 0 else (-inf, -inf))
+        return values[0]
+
+    def calculate_array(self, **arrays):
+        """Calculate the equation over whole arrays of values at once
+        using NumPy, e.g. equation.calculate_array(x=numpy.arange(10)).
+        The arrays are broadcast against each other and the result is a
+        float array of their broadcast shape. Equations using operators
+        without a kernel are calculated one point at a time through
+        compileMasked, since extendCalculate may not accept arrays.
+        Domain errors and overflow give nan and infinity, as in
+        calculate_masked, without raising or warning. Results are not
+        cached in self.solutions.
+        """
+        if numpy == None:
+            raise ImportError("calculate_array requires NumPy.")
+        if metrics.enabled:
+            start = perf_counter()
+            metrics.count(str(self), "arrayEvaluations")
+        arrays = {
+            key: numpy.asarray(value, dtype=float)
+            for key, value in arrays.items()
+        }
+        shape = numpy.broadcast_shapes(
+            *(array.shape for array in arrays.values())
+        )
+        if self.vectorizable():
+            with numpy.errstate(all="ignore"):
+                result = self.compileArray()(**arrays)
+            result = realArray(result, shape)
+            if metrics.enabled:
+                metrics.addTime(
+                    str(self), "calculate_array", perf_counter() - start
+                )
+            return result
+        calculate = self.compileMasked()
+        # Points are read as Python floats by samplePoints, so that
+        # extendCalculate handles errors as it does for any other number.
+        points = samplePoints({
+            key: numpy.broadcast_to(array, shape).ravel()
+            for key, array in arrays.items()
+        })
+        result = numpy.fromiter(
+            (calculate(**point) for point in points), dtype=float
+        )
+        if metrics.enabled:
+            metrics.addTime(
+                str(self), "calculate_array", perf_counter() - start
+            )
+        return result.reshape(shape)
+
+    def calculate_grid(self, **axes):
+        """Calculate the equation over every combination of the values
+        given for each variable, e.g. equation.calculate_grid(x=xs,
+        y=ys) returns a 2 dimensional float array whose [i, j] element
+        is the value at x=xs[i] and y=ys[j]. Each variable is given its
+        own axis in the order passed, and the values are broadcast
+        rather than repeated, so the equation is calculated in one pass
+        as calculate_array does.
+        """
+        if numpy == None:
+            raise ImportError("calculate_grid requires NumPy.")
+        arrays = {}
+        for index, (name, values) in enumerate(axes.items()):
+            shape = [1] * len(axes)
+            shape[index] = -1
+            arrays[name] = numpy.ravel(
+                numpy.asarray(values, dtype=float)
+            ).reshape(shape)
+        return self.calculate_array(**arrays)
+
+    def compile(self):
+        """Compile the equation into a native Python function which
+        takes each variable as an argument and returns the same value
+        as calculate, e.g. equation.compile()(x=2). Subequations are
+        inlined, so evaluating the function does not walk the tree.
+        The function is cached until the equation is next parsed.
+        """
+        if self.compiled == None and self.parsed != None:
+            self.compiled = self.parsed.compile()
+        if self.compiled == None:
+            lines = []
+            namespace = {}
+            result = self.compileTree(lines, namespace, {})
+            self.compiled = compileFunction(
+                lines, namespace, self.variables(), result,
+                "<equation " + str(self) + ">"
+            )
+        return self.compiled
+
+    def calculate_masked(self, **kwargs):
+        """Calculate the value of the equation like calculate, but give
+        nan where it is undefined, such as for sqrt(-1) or (-8)^0.5, and
+        an infinity where it divides by zero or overflows, rather than
+        raising. Results are not cached in self.solutions.
+        """
+        return self.compileMasked()(**kwargs)
+
+    def iter_evaluate(self, xs, chunk_size=65536):
+        """Calculate the equation at each value of x from an iterable,
+        which may be a generator of any length, yielding the values in
+        chunks of at most chunk_size as float arrays if NumPy is
+        installed and lists otherwise, e.g.
+        for values in equation.iter_evaluate(range(10**9)): ...
+        Only one chunk of xs and values is held at a time, and results
+        are not cached in self.solutions. Values are nan or infinity
+        where the equation is undefined, as in calculate_masked. The
+        backend is chosen once for chunk_size samples, and never the
+        interpreter, which keeps solutions. Requires the only variable
+        in the equation to be x.
+        """
+        if self.tree == None:
+            raise ValueError("Equations must end with a number or variable.")
+        if not self.variables() <= {"x"}:
+            raise ValueError("The only variable in " + str(self)
+                             + " must be x.")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1.")
+        chosen = selectBackend(
+            self, max(chunk_size, compiledBackend.minimumSamples)
+        )
+        xs = iter(xs)
+        while True:
+            if numpy != None:
+                chunk = numpy.fromiter(islice(xs, chunk_size), dtype=float)
+            else:
+                chunk = [float(x) for x in islice(xs, chunk_size)]
+            if len(chunk) == 0:
+                return
+            values = chosen.calculate(self, {"x": chunk})
+            if numpy != None:
+                values = numpy.asarray(values, dtype=float)
+            yield values
+
+    def compileMasked(self):
+        """Compile the equation into a native Python function like
+        compile, but which calculates it as calculate_masked does. The
+        function is cached until the equation is next parsed.
+        """
+        if self.compiledMasked == None and self.parsed != None:
+            self.compiledMasked = self.parsed.compileMasked()
+        if self.compiledMasked == None:
+            lines = []
+            namespace = {}
+            result = self.compileTree(lines, namespace, {}, masked=True)
+            self.compiledMasked = compileFunction(
+                lines, namespace, self.variables(), result,
+                "<equation " + str(self) + ">"
+            )
+        return self.compiledMasked
+
+    def compileArray(self):
+        """Compile the equation into a native Python function like
+        compile, but applying the kernel of each operator so that it
+        can be called with whole NumPy arrays. Requires the equation to
+        be vectorizable. While metrics are enabled, a separate function
+        is compiled which records the time spent in each kernel.
+        """
+        timed = metrics.enabled
+        compiled = self.timedArray if timed else self.compiledArray
+        if compiled == None and self.parsed != None:
+            compiled = self.parsed.compileArray()
+        if compiled == None:
+            lines = []
+            namespace = {}
+            result = self.compileTree(
+                lines, namespace, {}, kernels=True, timed=timed
+            )
+            compiled = compileFunction(
+                lines, namespace, self.variables(), result,
+                "<equation " + str(self) + ">"
+            )
+        if timed:
+            self.timedArray = compiled
         else:
-            return None
+            self.compiledArray = compiled
+        return compiled
+
+    def bind(self, names, masked=False):
+        """Compile the equation into a native Python function taking
+        the value of each of names as positional arguments in order,
+        e.g. equation.bind(("x", "t"))(2, 0.5). Each variable is
+        resolved to its argument when compiled, so calling the function
+        does not build or sort a dictionary of keyword arguments as
+        calculate does. Every variable of the equation must be in names.
+        If masked is True, the function calculates the equation as
+        calculate_masked does. The function is cached until the equation
+        is next parsed.
+        """
+        names = tuple(names)
+        key = (names, masked)
+        if key not in self.bound and self.parsed != None:
+            self.bound[key] = self.parsed.bind(names, masked)
+        if key not in self.bound:
+            if len(set(names)) != len(names):
+                raise ValueError("Each variable may only be bound once.")
+            missing = self.variables() - set(names)
+            if missing:
+                raise ValueError(
+                    "Variables " + ", ".join(sorted(missing))
+                    + " must be bound."
+                )
+            codes = {
+                name: "a" + str(index) for index, name in enumerate(names)
+            }
+            lines = []
+            namespace = {}
+            result = self.compileTree(
+                lines, namespace, {}, codes=codes, masked=masked
+            )
+            self.bound[key] = compileFunction(
+                lines, namespace, [codes[name] for name in names], result,
+                "<equation " + str(self) + ">", keywords=False
+            )
+        return self.bound[key]
+
+    def compileTree(self, lines:list, namespace:dict, shared:dict,
+                    kernels=False, codes=None, timed=False, masked=False):
+        """Append Python statements calculating the equation to lines,
+        one temporary variable per operation, and return the name of
+        the temporary holding the result. The arithmetic operators are
+        written as Python operators, and any other operators and every
+        function are called through namespace, using their kernels if
+        kernels is True. If timed is True, every operator and function
+        is called through namespace, timed by timedFunction. If masked
+        is True, operators and functions which may raise are called
+        through namespace as their masked versions from maskedFunctions
+        or maskedCall. Constants are written by constantCode. shared
+        maps each operation already in lines to its temporary, so that
+        repeated subexpressions, including those of other equations
+        compiled into the same lines, are only calculated once. codes
+        maps each variable to the Python expression reading its value,
+        by default its own name or a lookup in the keyword arguments of
+        compileFunction where the name is not a valid Python argument.
+        """
+        if self.tree == None:
+            raise ValueError("Equations must end with a number or variable.")
+        values = []
+        for node in postorder(self.tree):
+            if type(node) == expression:
+                right = values.pop()
+                left = values.pop()
+                symbol = node.operator.symbol
+                key = (symbol, type(node.operator), left, right)
+                if key in shared:
+                    values.append(shared[key])
+                    continue
+                temp = "t" + str(len(lines))
+                shared[key] = temp
+                if symbol in infixOperators and not timed and not (
+                        masked and symbol in ["/", "^"]):
+                    lines.append(
+                        temp + " = " + left + " " + infixOperators[symbol]
+                        + " " + right
+                    )
+                else:
+                    function = "op" + str(len(lines))
+                    if kernels:
+                        namespace[function] = node.operator.kernel
+                    elif masked:
+                        namespace[function] = maskedFunctions.get(
+                            symbol, maskedCall(node.operator.function)
+                        )
+                    else:
+                        namespace[function] = node.operator.function
+                    if timed:
+                        namespace[function] = timedFunction(
+                            symbol, namespace[function]
+                        )
+                    lines.append(
+                        temp + " = " + function + "(" + left + ", "
+                        + right + ")"
+                    )
+                values.append(temp)
+            elif type(node) == functionCall:
+                argument = values.pop()
+                key = (node.function.name, type(node.function), argument)
+                if key in shared:
+                    values.append(shared[key])
+                    continue
+                temp = "t" + str(len(lines))
+                shared[key] = temp
+                function = "op" + str(len(lines))
+                if kernels:
+                    namespace[function] = node.function.kernel
+                elif masked:
+                    namespace[function] = maskedFunctions.get(
+                        node.function.name, maskedCall(node.function.function)
+                    )
+                else:
+                    namespace[function] = node.function.function
+                if timed:
+                    namespace[function] = timedFunction(
+                        node.function.name, namespace[function]
+                    )
+                lines.append(temp + " = " + function + "(" + argument + ")")
+                values.append(temp)
+            elif type(node) == equation:
+                if node.sign == "-":
+                    values.append("(-" + values.pop() + ")")
+            elif type(node) == variable:
+                if codes != None:
+                    code = codes[node.symbol]
+                else:
+                    code = variableCode(node.symbol)
+                if node.sign == "-":
+                    values.append("(-" + code + ")")
+                else:
+                    values.append(code)
+            else:
+                values.append(constantCode(
+                    node, namespace, shared, kernels=kernels, masked=masked
+                ))
+        return values[0]
+
+class equationGroup:
+    """A group of equations, such as every formula on the canvas,
+    compiled together into one function. Subexpressions which appear
+    more than once across the group, like the x+1 in (x+1)^2 and
+    3(x+1)^2, are calculated once and shared.
+    """
+    def __init__(self, equations:list):
+        self.equations = list(equations)
+        self.trees = [equation.tree for equation in self.equations]
+        self.compiled = None
+        self.compiledArray = None
+        self.compiledMasked = None
+
+    def compile(self, kernels=False, masked=False):
+        """Compile the group into a native Python function which takes
+        each variable as an argument and returns a tuple holding the
+        value of each equation. If kernels is True, the function applies
+        the kernel of each operator so it can be called with arrays.
+        Otherwise, if masked is True, it calculates each equation as
+        equation.calculate_masked does.
+        """
+        masked = masked and not kernels
+        if kernels and self.compiledArray != None:
+            return self.compiledArray
+        if masked and self.compiledMasked != None:
+            return self.compiledMasked
+        if not kernels and not masked and self.compiled != None:
+            return self.compiled
+        lines = []
+        namespace = {}
+        shared = {}
+        names = set()
+        results = []
+        for equation in self.equations:
+            results.append(equation.compileTree(
+                lines, namespace, shared, kernels, masked=masked
+            ))
+            names |= equation.variables()
+        # A tuple of one value needs a trailing comma, and an empty
+        # tuple, for a group whose last formula was removed, cannot
+        # have one.
+        result = "(" + ", ".join(results)
+        if len(results) == 1:
+            result += ","
+        compiled = compileFunction(
+            lines, namespace, names, result + ")", "<equation group>"
+        )
+        if kernels:
+            self.compiledArray = compiled
+        elif masked:
+            self.compiledMasked = compiled
+        else:
+            self.compiled = compiled
+        return compiled
+
+    def calculate(self, **kwargs):
+        """Return a list of the value of each equation given a float or
+        integer value for each variable.
+        """
+        return list(self.compile()(**kwargs))
+
+    def calculate_array(self, **arrays):
+        """Return a list of float arrays holding the value of each
+        equation over whole arrays of values at once, as
+        equation.calculate_array does. If any equation uses operators
+        without a kernel, or metrics are enabled so that each equation
+        is timed, each equation is calculated separately.
+        """
+        if numpy == None:
+            raise ImportError("calculate_array requires NumPy.")
+        if metrics.enabled or not all(
+                equation.vectorizable() for equation in self.equations):
+            return [
+                equation.calculate_array(**arrays)
+                for equation in self.equations
+            ]
+        arrays = {
+            key: numpy.asarray(value, dtype=float)
+            for key, value in arrays.items()
+        }
+        shape = numpy.broadcast_shapes(
+            *(array.shape for array in arrays.values())
+        )
+        with numpy.errstate(all="ignore"):
+            results = self.compile(kernels=True)(**arrays)
+        return [realArray(result, shape) for result in results]
+
+class backend:
+    """A way of calculating equations and equationGroups over many
+    samples of their variables, chosen for each calculation by
+    selectBackend. Backends are tried in the order of the backends list,
+    and the first which is available, supports every equation and is
+    worth using for at least minimumSamples samples is used. Samples
+    are given as a dict of each variable's values, which must all be
+    the same length or single numbers. Every backend gives nan, or an
+    infinity where it can tell, wherever an equation is undefined
+    rather than raising. A backend which releasesLock spends most of
+    its time outside the interpreter lock and changes no shared state,
+    so it can calculate different equations on several threads at once.
+    """
+    name = "backend"
+    minimumSamples = 0
+    releasesLock = False
+
+    def available(self):
+        """Return whether the backend can be used in this process."""
+        return True
+
+    def supports(self, equation):
+        """Return whether the backend can calculate an equation."""
+        return True
+
+    def calculate(self, equation, samples:dict):
+        """Return a list of the equation's value at each sample."""
+        raise NotImplementedError
+
+    def calculateGroup(self, group, samples:dict):
+        """Return a list holding a list of each equation's value at
+        each sample.
+        """
+        return [
+            self.calculate(equation, samples) for equation in group.equations
+        ]
+
+class interpreterBackend(backend):
+    """Calculates each sample by running the masked postfix program from
+    equation.lower, which costs nothing to set up, so it is used for
+    single samples. It follows the same masked rules as the compiled
+    and numpy backends, so every backend gives the same values.
+    """
+    name = "interpreter"
+    minimumSamples = 0
+
+    def calculate(self, equation, samples):
+        calculate = equation.lower(masked=True).calculate
+        values = []
+        for point in samplePoints(samples):
+            value = calculate(**point)
+            values.append(math.nan if type(value) == complex else value)
+        return values
+
+class compiledBackend(backend):
+    """Calculates each sample with the native Python function from
+    equation.compileMasked, which is compiled once and then much faster
+    per sample than the interpreter.
+    """
+    name = "compiled"
+    minimumSamples = 2
+
+    def calculate(self, equation, samples):
+        calculate = equation.compileMasked()
+        return [calculate(**point) for point in samplePoints(samples)]
+
+    def calculateGroup(self, group, samples):
+        calculate = group.compile(masked=True)
+        results = [calculate(**point) for point in samplePoints(samples)]
+        return [list(values) for values in zip(*results)] or [
+            [] for equation in group.equations
+        ]
+
+class numpyBackend(backend):
+    """Calculates every sample at once with equation.calculate_array,
+    which has a fixed cost of a few microseconds per operator, so it is
+    only used for equations with a kernel for every operator and
+    function, and enough samples to make up for that cost.
+    """
+    name = "numpy"
+    minimumSamples = 32
+    releasesLock = True
+
+    def available(self):
+        return numpy != None
+
+    def supports(self, equation):
+        return equation.vectorizable()
+
+    def calculate(self, equation, samples):
+        return equation.calculate_array(**samples)
+
+    def calculateGroup(self, group, samples):
+        return group.calculate_array(**samples)
+
+# Backends tried by selectBackend, in order of preference.
+backends = [numpyBackend(), compiledBackend(), interpreterBackend()]
 
 class variable:
     """Class meant for distinguishing mathematical variables from string
     characters. Provides no particular logic, used only for checking
-    types.
+    types. Instances are flyweights shared by symbol and sign, and must
+    not be modified.
     """
+    __slots__ = ("symbol", "sign")
+    # The shared instance for each class, symbol and sign.
+    interned = {}
+
+    def __new__(cls, symbol:str, sign=""):
+        key = (cls, symbol, sign)
+        instance = variable.interned.get(key)
+        if instance == None:
+            instance = super().__new__(cls)
+            variable.interned[key] = instance
+        return instance
+
+    def __getnewargs__(self):
+        return (self.symbol, self.sign)
+
     def __init__(self, symbol:str, sign=""):
         self.symbol = symbol
         self.sign = sign
 
     def __str__(self):
-        return self.sign + self.symbol
\ No newline at end of file
+        return self.sign + self.symbol
+
+
+# Compiled token patterns for each list of allowed operations.
+tokenPatterns = {}
+
+# Compiled patterns splitting runs of letters into names, with the set
+# of names each one knows, for each list of variable names and the
+# constants defined at the time. Cleared by registerFunction, since
+# every pattern knows the registered functions.
+namePatterns = {}
+
+def registerOperator(symbol:str, function, kernel=None, precedence=None,
+                     associativity="left", interval=None):
+    """Add an operator to operatorRegistry and to allowedOperations, so
+    that equations can use it without a custom operator class. function
+    applies the operator to two numbers, and kernel and interval, if
+    given, to two NumPy arrays and two intervals. precedence defaults to
+    after every existing operator.
+    """
+    global operatorRegistry
+    if symbol in operatorRegistry:
+        raise ValueError(symbol + " is already a registered operator.")
+    if precedence == None:
+        precedence = max(
+            definition.precedence for definition in operatorRegistry.values()
+        ) + 1
+    registry = dict(operatorRegistry)
+    registry[symbol] = operatorDefinition(
+        precedence, associativity, function, kernel, interval
+    )
+    operatorRegistry = MappingProxyType(registry)
+    allowedOperations.append(symbol)
+    allowedOperations.sort(key=lambda op: operatorRegistry[op].precedence)
+
+def registerFunction(name:str, function, kernel=None, interval=None):
+    """Add a function of one number to functionRegistry, so that
+    equations can call it by name. function applies it to a number, and
+    kernel and interval, if given, to a NumPy array and an interval.
+    """
+    global functionRegistry
+    if name in functionRegistry:
+        raise ValueError(name + " is already a registered function.")
+    if not re.fullmatch(r"[^\W\d]+", name):
+        raise ValueError(
+            "Function names must be made of letters, not " + repr(name) + "."
+        )
+    registry = dict(functionRegistry)
+    registry[name] = functionDefinition(function, kernel, interval)
+    functionRegistry = MappingProxyType(registry)
+    namePatterns.clear()
+
+def samplePoints(samples:dict):
+    """Yield a dict of each variable's value at each sample, given a
+    dict of each variable's values, which must all be the same length
+    or single numbers. NumPy arrays are read as Python numbers, so that
+    errors are handled as they are for any other number.
+    """
+    count = sampleCount(samples)
+    samples = {
+        name: values.tolist() if hasattr(values, "tolist") else values
+        for name, values in samples.items()
+    }
+    for index in range(count):
+        yield {
+            name: values[index] if hasattr(values, "__len__") else values
+            for name, values in samples.items()
+        }
+
+def sampleCount(samples:dict):
+    """Return the number of samples in a dict of each variable's values,
+    counting single numbers as one sample.
+    """
+    return max(
+        [len(values) if hasattr(values, "__len__") else 1
+         for values in samples.values()],
+        default=1
+    )
+
+def registerBackend(newBackend:backend, first=True):
+    """Add a backend to the list tried by selectBackend, before every
+    existing backend unless first is False.
+    """
+    if first:
+        backends.insert(0, newBackend)
+    else:
+        backends.append(newBackend)
+
+def selectBackend(formula, count:int):
+    """Return the first backend in backends which is available, supports
+    the formula, an equation or an equationGroup, and is worth using for
+    count samples.
+    """
+    if type(formula) == equationGroup:
+        group = formula.equations
+    else:
+        group = [formula]
+    for candidate in backends:
+        if count >= candidate.minimumSamples and candidate.available() and (
+                all(candidate.supports(equation) for equation in group)):
+            return candidate
+    raise ValueError("No backend can calculate " + str(formula) + ".")
+
+def calculateSamples(formula, **samples):
+    """Calculate an equation, or each equation of an equationGroup, at
+    every sample of its variables using the backend chosen by
+    selectBackend, e.g. calculateSamples(formula, x=xs). Returns a float
+    array if NumPy is installed and a list otherwise, or a list of them
+    for a group. Values are nan or infinity where the equation is
+    undefined.
+    """
+    chosen = selectBackend(formula, sampleCount(samples))
+    if type(formula) == equationGroup:
+        results = chosen.calculateGroup(formula, samples)
+    else:
+        results = [chosen.calculate(formula, samples)]
+    if numpy != None:
+        results = [numpy.asarray(values, dtype=float) for values in results]
+    if type(formula) == equationGroup:
+        return results
+    return results[0]
+
+def enableMetrics():
+    """Start recording metrics in a new metricsRecorder, which is
+    returned and can be read at any time.
+    """
+    global metrics
+    metrics = metricsRecorder()
+    return metrics
+
+def disableMetrics():
+    """Stop recording metrics, returning the recorder which was in use
+    so that what it recorded can still be read.
+    """
+    global metrics
+    recorder = metrics
+    metrics = disabledMetrics()
+    return recorder
+
+def timedFunction(name:str, function):
+    """Return a function which calls function, adding the time it takes
+    to the "kernel" timer of name in metrics.
+    """
+    def timed(*arguments):
+        start = perf_counter()
+        try:
+            return function(*arguments)
+        finally:
+            metrics.addTime(name, "kernel", perf_counter() - start)
+    return timed
+
+def operatorOrder(operator, allowed):
+    """Return the operations for a list of allowed operations, in order,
+    as instances of operator. Equations with the same operator class
+    and allowed operations share one tuple of instances.
+    """
+    key = (operator, tuple(allowed))
+    if key not in operatorOrders:
+        operatorOrders[key] = tuple(operator(op) for op in allowed)
+    return operatorOrders[key]
+
+def tokenize(symbolStr:str, allowed=allowedOperations, names=None):
+    """Split a string into a list of (kind, text) tokens in a single
+    pass, where kind is one of "number", "operator", "paren",
+    "function", "constant" or "name". Whitespace is dropped and any
+    other character is read as a variable name. A run of letters is
+    split by splitNames into functions, constants and variables, which
+    are single letters unless a list of variable names is given. A
+    variable in names is read as one even if a function or constant has
+    the same name. A minus sign is always read as an operator so that
+    the parser can decide whether it negates.
+    """
+    key = tuple(allowed)
+    if key not in tokenPatterns:
+        symbols = sorted(set(allowed) | {"-"}, key=len, reverse=True)
+        tokenPatterns[key] = re.compile(
+            r"(?P<number>[0-9.]+)|(?P<space>\s+)|(?P<paren>[()])"
+            r"|(?P<operator>" + "|".join(map(re.escape, symbols)) + ")"
+            r"|(?P<name>[^\W\d]+|.)"
+        )
+    tokens = []
+    for match in tokenPatterns[key].finditer(symbolStr):
+        if match.lastgroup == "name":
+            for name in splitNames(match.group(), names):
+                if names != None and name in names:
+                    tokens.append(("name", name))
+                elif name in functionRegistry:
+                    tokens.append(("function", name))
+                elif name in constants:
+                    tokens.append(("constant", name))
+                else:
+                    tokens.append(("name", name))
+        elif match.lastgroup != "space":
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+def splitNames(text:str, names=None):
+    """Split text into a list of names, taking the longest of names,
+    functions and constants which fits at each point, e.g. "thetax"
+    with the names theta and x gives ["theta", "x"]. Without names, any
+    other character is its own variable.
+    """
+    if names != None:
+        names = tuple(names)
+    key = (names, tuple(constants))
+    if key not in namePatterns:
+        known = set(functionRegistry) | set(constants) | set(names or ())
+        known = sorted(known, key=len, reverse=True)
+        # Alternatives are tried in order, so the longest name wins,
+        # and anything else is read one character at a time.
+        namePatterns[key] = (
+            re.compile("|".join(map(re.escape, known)) + "|."), set(known)
+        )
+    pattern, known = namePatterns[key]
+    found = pattern.findall(text)
+    if names != None:
+        for index, name in enumerate(found):
+            if name not in known:
+                raise ValueError(
+                    "".join(found[index:]) + " is not one of the variables "
+                    + ", ".join(sorted(names)) + "."
+                )
+    return found
+
+def foldConstants(symbol:str, left:float|int, right:float|int):
+    """Return the result of applying one of the arithmetic operators in
+    infixOperators to two numbers, or None if the result is an error or
+    not a finite real number.
+    """
+    # Avoid building enormous integers while parsing.
+    if symbol == "^" and type(right) == int and abs(right) > 1024:
+        return None
+    try:
+        value = operatorRegistry[symbol].function(left, right)
+    except ArithmeticError:
+        return None
+    if not isFiniteConstant(value):
+        return None
+    return value
+
+def foldFunction(function:unaryFunction, argument:float|int):
+    """Return the result of applying a function to a number, or None if
+    the result is an error or not a finite real number.
+    """
+    try:
+        value = function.function(argument)
+    except (ArithmeticError, ValueError):
+        return None
+    if not isFiniteConstant(value):
+        return None
+    return value
+
+def isFiniteConstant(value):
+    """Return whether value is an int or float which can be turned into
+    a finite float, and so can be kept as a constant by simplify without
+    overflowing, or being written as inf, when it is calculated.
+    """
+    if type(value) not in [int, float]:
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+def simplifyExpression(node:expression, operators:dict):
+    """Return a simplified replacement for an expression whose operands
+    have already been simplified. See equation.simplify.
+    """
+    symbol = node.operator.symbol
+    left = node.left
+    right = node.right
+    if symbol not in infixOperators:
+        return node
+    leftConstant = type(left) in [int, float]
+    rightConstant = type(right) in [int, float]
+    if leftConstant and rightConstant:
+        value = foldConstants(symbol, left, right)
+        if value != None:
+            return value
+    # Identities
+    if symbol == "*" and leftConstant and left == 1:
+        return right
+    if symbol == "+" and leftConstant and left == 0:
+        return right
+    if rightConstant and (
+            (symbol in ["*", "/", "^"] and right == 1)
+            or (symbol in ["+", "-"] and right == 0)):
+        return left
+    # Gather a constant into the constant of the chain on the left, e.g.
+    # (x+4)-4 becomes x+(4-4) and then x.
+    if rightConstant and type(left) == expression:
+        inner = left.operator.symbol
+        combine = None
+        if symbol in ["+", "-"] and inner in ["+", "-"]:
+            combine = symbol
+            if inner == "-" and type(left.right) in [int, float]:
+                # (a-c1)+c2 is a-(c1-c2), and (a-c1)-c2 is a-(c1+c2).
+                combine = "-" if symbol == "+" else "+"
+        elif symbol == "*" and inner == "*":
+            combine = symbol
+        if combine != None and type(left.right) in [int, float]:
+            value = foldConstants(combine, left.right, right)
+            if value != None:
+                return simplifyExpression(
+                    expression(left.operator, left.left, value), operators
+                )
+        elif combine != None and type(left.left) in [int, float]:
+            value = foldConstants(symbol, left.left, right)
+            if value != None:
+                return simplifyExpression(
+                    expression(left.operator, value, left.right), operators
+                )
+    # Write x+-3 as x-3 and x--3 as x+3.
+    if symbol in ["+", "-"] and rightConstant and right < 0:
+        other = "-" if symbol == "+" else "+"
+        if other in operators:
+            return expression(operators[other], left, -right)
+    return node
+
+def combineSigns(inner, outer):
+    """Return the sign of a negated variable or subequation once it is
+    taken out of a subequation with its own sign.
+    """
+    return "-" if (inner.sign == "-") != (outer.sign == "-") else ""
+
+def entrySize(key, value):
+    """Return the approximate number of bytes used by a cache entry,
+    counting its key, value and the items of any tuples in the key.
+    """
+    size = getsizeof(key) + getsizeof(value)
+    pending = list(key) if type(key) == tuple else []
+    while pending:
+        item = pending.pop()
+        size += getsizeof(item)
+        if type(item) == tuple:
+            pending.extend(item)
+    return size
+
+def compileFunction(lines:list, namespace:dict, names, result:str,
+                    filename:str, keywords=True):
+    """Build a Python function named compiled from lines of statements
+    and the expression it returns, taking each of names as an argument,
+    and return it. Extra keyword arguments are accepted and ignored,
+    matching equation.calculate, and hold any variable whose name
+    cannot be an argument. If keywords is False, names are taken as
+    positional arguments in the order given and nothing else is
+    accepted.
+    """
+    if keywords:
+        names = [name for name in sorted(names) if isArgument(name)]
+        names.append("**unused")
+    source = "def compiled(" + ", ".join(names) + "):\n"
+    for line in lines:
+        source += "    " + line + "\n"
+    source += "    return " + result + "\n"
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace["compiled"]
+
+def floatConstant(value):
+    """Return a constant as a float, or an infinity of its sign if it is
+    an int too large to be one.
+    """
+    try:
+        return float(value)
+    except OverflowError:
+        return math.copysign(inf, value)
+
+def constantCode(value, namespace:dict, shared:dict, kernels=False,
+                 masked=False):
+    """Return the Python expression for a constant inside a function
+    built by compileFunction. Infinities and nan have no literal, so
+    they are stored in namespace and read by name. If masked is True,
+    every constant is stored as a float, so that arithmetic on it gives
+    infinity where it overflows rather than raising as int arithmetic
+    can. If kernels is True, every constant is stored as a NumPy float,
+    so that arithmetic on constants alone follows NumPy's rules too,
+    giving nan or infinity without raising and never a complex number.
+    shared maps each constant already stored to its name.
+    """
+    if kernels or masked or (
+            type(value) == float and not math.isfinite(value)):
+        key = ("constant", type(value), value)
+        if key in shared:
+            return shared[key]
+        number = floatConstant(value)
+        if kernels:
+            number = numpy.float64(number)
+        name = "c" + str(len(namespace))
+        namespace[name] = number
+        shared[key] = name
+        return name
+    if value >= 0:
+        return repr(value)
+    return "(" + repr(value) + ")"
+
+def isArgument(name:str):
+    """Return whether a variable can be passed to a compiled function
+    as an argument of the same name.
+    """
+    return (name.isidentifier() and not keyword.iskeyword(name)
+            and name not in ["compiled", "unused"])
+
+def variableCode(name:str):
+    """Return the Python expression reading a variable inside a
+    function built by compileFunction.
+    """
+    if isArgument(name):
+        return name
+    return "unused[" + repr(name) + "]"
+
+def normalize(tokens:list):
+    """Return the text of a list of tokens with multiplication written
+    out wherever it was implied, e.g. the tokens of "2 x(x+1)" give
+    "2*x*(x+1)".
+    """
+    text = ""
+    previous = None
+    for kind, token in tokens:
+        if (previous in ["number", "name", "constant"]
+                or previous == ")") and (
+                kind in ["number", "name", "constant", "function"]
+                or token == "("):
+            text += "*"
+        text += token
+        previous = token if kind == "paren" else kind
+    return text
+
+def postorder(tree):
+    """Yield every node of an expression tree, each one after all of
+    the nodes beneath it. Subequations are yielded after their
+    contents. Uses an explicit stack, so deep trees are supported.
+    """
+    pending = [(tree, False)]
+    while pending:
+        node, visited = pending.pop()
+        if visited:
+            yield node
+        elif type(node) == expression:
+            pending.append((node, True))
+            pending.append((node.right, False))
+            pending.append((node.left, False))
+        elif type(node) == functionCall:
+            pending.append((node, True))
+            pending.append((node.argument, False))
+        elif type(node) == equation:
+            pending.append((node, True))
+            pending.append((node.tree, False))
+        else:
+            yield node
+
+def formatTree(tree, order=allowedOperations):
+    """Return the text of an expression tree with every operator
+    written out and only the parentheses that subequations and the
+    order of operations require.
+    """
+    precedence = {str(op): index for index, op in enumerate(order)}
+    texts = []
+    for node in postorder(tree):
+        if type(node) == expression:
+            right, rightLevel = texts.pop()
+            left, leftLevel = texts.pop()
+            symbol = node.operator.symbol
+            level = precedence.get(symbol, len(precedence))
+            if leftLevel > level:
+                left = "(" + left + ")"
+            if rightLevel >= level:
+                right = "(" + right + ")"
+            texts.append((left + symbol + right, level))
+        elif type(node) == functionCall:
+            text, level = texts.pop()
+            texts.append((node.function.name + "(" + text + ")", -1))
+        elif type(node) == equation:
+            text, level = texts.pop()
+            texts.append((node.sign + "(" + text + ")", -1))
+        else:
+            texts.append((str(node), -1))
+    return texts[0][0]
@@ -0,0 +1,129 @@
+"""Finds the local minima and maxima of equations of x over an
+interval.
+"""
+
+import equations, roots
+from math import floor, isfinite, sqrt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of samples in each block of the x axis scanned for extrema.
+# Blocks are fixed in place for each spacing of samples, so that when
+# the view is moved only the blocks newly in view are scanned.
+blockSize = 64
+
+# The extrema found in each block, keyed by the equation, the spacing
+# of samples, the block and the tolerance.
+extremaCache = equations.lruCache(maxEntries=4096)
+
+def extrema(formula:equations.equation, lo:float, hi:float, step:float,
+            tolerance=1e-8):
+    """Return a sorted list of (x, y, kind) tuples for the local minima
+    and maxima of the formula between lo and hi, where kind is
+    "minimum" or "maximum". The formula is sampled every step along x,
+    each sample greater or less than both of its neighbours is narrowed
+    down to the extremum near it by golden section search, and extrema
+    closer together than step may be missed. Only blocks of the x axis
+    which have not been scanned before with the same step are sampled,
+    all in one pass. Requires the only variable in the equation to be x.
+    """
+    width = step*blockSize
+    blocks = range(floor(lo/width), floor(hi/width)+1)
+    found = {}
+    missing = []
+    for block in blocks:
+        key = (roots.cacheKey(formula), step, block, tolerance)
+        found[block] = extremaCache.get(key)
+        if found[block] == None:
+            missing.append(block)
+    if missing:
+        function = roots.maskedFunction(formula)
+        # Each block is sampled one step past either end, so that its
+        # first and last samples can be compared with their neighbours.
+        indices = [
+            block*blockSize + index
+            for block in missing for index in range(-1, blockSize+1)
+        ]
+        if numpy != None:
+            xs = numpy.array(indices)*step
+        else:
+            xs = [index*step for index in indices]
+        values = roots.sample(formula, xs)
+        for number, block in enumerate(missing):
+            start = number*(blockSize+2)
+            found[block] = scanBlock(
+                function, xs[start:start+blockSize+2],
+                values[start:start+blockSize+2], tolerance
+            )
+            extremaCache.put(
+                (roots.cacheKey(formula), step, block, tolerance),
+                found[block]
+            )
+    return [
+        point for block in blocks for point in found[block]
+        if lo <= point[0] <= hi
+    ]
+
+def scanBlock(function, xs, values, tolerance:float):
+    """Return a list of (x, y, kind) tuples for the extrema of function
+    near each of xs, except the first and last, whose value is greater
+    or less than the values either side of it.
+    """
+    if numpy != None:
+        values = numpy.asarray(values)
+        left, middle, right = values[:-2], values[1:-1], values[2:]
+        maxima = numpy.flatnonzero((middle > left) & (middle >= right))
+        minima = numpy.flatnonzero((middle < left) & (middle <= right))
+        candidates = [(index, "maximum") for index in maxima.tolist()]
+        candidates += [(index, "minimum") for index in minima.tolist()]
+    else:
+        candidates = []
+        for index in range(len(values)-2):
+            left, middle, right = values[index:index+3]
+            if middle > left and middle >= right:
+                candidates.append((index, "maximum"))
+            elif middle < left and middle <= right:
+                candidates.append((index, "minimum"))
+    points = []
+    for index, kind in sorted(candidates):
+        a, b = float(xs[index]), float(xs[index+2])
+        try:
+            if kind == "minimum":
+                x = goldenSection(function, a, b, tolerance)
+            else:
+                x = goldenSection(lambda x: -function(x), a, b, tolerance)
+        except (ArithmeticError, ValueError):
+            continue
+        y = function(x)
+        if isfinite(y):
+            points.append((x, y, kind))
+    return points
+
+def goldenSection(function, a:float, b:float, tolerance=1e-8,
+                  maxIterations=200):
+    """Return the x between a and b at which function is least, given
+    that it has only one minimum there. Each step keeps the part of the
+    interval holding the lesser of two points placed at the golden
+    ratio, so one of them can be reused and only one new value is
+    calculated per step.
+    """
+    ratio = (sqrt(5) - 1)/2
+    c = b - ratio*(b - a)
+    d = a + ratio*(b - a)
+    fc = function(c)
+    fd = function(d)
+    for iteration in range(maxIterations):
+        if abs(b - a) <= tolerance*max(1, abs(a) + abs(b)):
+            break
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio*(b - a)
+            fc = function(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio*(b - a)
+            fd = function(d)
+    return (a + b)/2
@@ -2,12 +2,17 @@
 Designed and coded by Matthew Tien Wells, 2024.
 """
 
-import tkinter, equations
+import tkinter, equations, roots, integrals, extrema, scheduler, sampling
 import tkinter.colorchooser
 from tkinter import ttk, Tk
-from math import floor, ceil
+from math import floor, ceil, isfinite
 from functools import partial
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class canvasView:
     """Class representing the view of the coordinate plane shown on
     the canvas widget.
@@ -49,9 +54,11 @@ class canvasView:
 view = canvasView()
 
 def toCanvas(x, y):
-    """Convert x and y coordinates to fit the tkinter canvas system."""
-    x += view.x_center
-    y += view.y_center
+    """Convert x and y coordinates to fit the tkinter canvas system.
+    Works on arrays as well as single numbers, without modifying them.
+    """
+    x = x + view.x_center
+    y = y + view.y_center
     x *= view.zoom
     y *= view.zoom
     x += view.width/2
@@ -87,6 +94,22 @@ formulaDisplay.grid(column=1,row=0)
 solutionsDisplay = tkinter.Frame(root)
 solutionsDisplay.grid(row=0,column=3)
 
+showEnvelopes = tkinter.BooleanVar(value=False)
+showRoots = tkinter.BooleanVar(value=False)
+showExtrema = tkinter.BooleanVar(value=False)
+shadeBetween = tkinter.BooleanVar(value=False)
+
+# The x values between which the area under the newest formula is
+# shaded, set by dragging with the right mouse button. Empty when no
+# area is shaded.
+areaBounds = []
+
+# Tolerance of the integral shown with the shaded area, and the looser
+# one used while its bounds are being dragged so that the canvas keeps
+# up with the mouse.
+areaTolerance = 1e-10
+dragAreaTolerance = 1e-6
+
 def chooseFormulaColor():
     """Select a color to draw a new formula with."""
     # High contrast color palette to ensure accessibility per WCAG
@@ -112,17 +135,223 @@ def drawFormula(formula:equations.equation|None=None, input=formulaInput):
     if input != None:
         formulaStr = input.get(1.0, "end-1c")
         formula.parse(formulaStr)
-    elif formula.symbols == []:
+    elif formula.tree == None:
+        return None
+
+    zNums = viewSamples()
+    values, runs = sampling.sampleFormula(formula, zNums, *viewRange())
+    drawSamples(formula, zNums, values, runs)
+
+def viewSamples():
+    """Return the x value of each pixel column in view, as an array if
+    NumPy is installed and as a list otherwise.
+    """
+    return sampling.viewSamples(
+        fromCanvas(view.width/2, view.height/2)[0], view.zoom, view.width
+    )
+
+def viewRange():
+    """Return the values of y at the bottom and top of the canvas."""
+    return (fromCanvas(0, view.height)[1], fromCanvas(0, 0)[1])
+
+def drawSamples(formula:equations.equation, zNums, values, runs):
+    """Draw a formula on the canvas as lines through its values at
+    each of zNums, over each (start, stop) slice in runs, broken
+    wherever a value is not finite.
+    """
+    for start, stop in sampling.finiteRuns(values, runs):
+        if stop - start < 2:
+            continue
+        if numpy != None:
+            canvasX, canvasY = toCanvas(zNums[start:stop], values[start:stop])
+            linePoints = numpy.column_stack((canvasX, canvasY)).ravel().tolist()
+        else:
+            linePoints = [
+                toCanvas(zNum, value)
+                for zNum, value in zip(zNums[start:stop], values[start:stop])
+            ]
+        canvas.create_line(linePoints, fill=formula.color)
+    if showEnvelopes.get():
+        drawEnvelope(formula, zNums)
+    if showRoots.get():
+        drawRoots(formula)
+    if showExtrema.get():
+        drawExtrema(formula)
+
+def drawEnvelope(formula:equations.equation, zNums):
+    """Draw the range of values the formula may take across each pixel
+    column as a vertical line, so that a formula which oscillates
+    faster than the columns are sampled is still shown correctly. The
+    columns are culled by interval arithmetic rather than by the values
+    sampled, which may all miss the canvas where the formula does not.
+    """
+    bottom, top = viewRange()
+    for start, stop in sampling.visibleRuns(formula, zNums, bottom, top):
+        for index in range(start, stop-1):
+            low, high = formula.calculate_interval(
+                x=(zNums[index], zNums[index+1])
+            )
+            low = max(low, bottom)
+            high = min(high, top)
+            if low > high:
+                continue
+            canvasX, lowY = toCanvas(zNums[index], low)
+            canvasX, highY = toCanvas(zNums[index], high)
+            if lowY - highY >= 2:
+                canvas.create_line(
+                    [canvasX, lowY, canvasX, highY], fill=formula.color
+                )
+
+def drawRoots(formula:equations.equation):
+    """Mark the roots of the formula in view on the canvas, and the
+    points where it crosses each formula listed before it. Roots are
+    cached by the roots module, so redrawing the same view does not
+    search for them again.
+    """
+    left = fromCanvas(0, 0)[0]
+    right = fromCanvas(view.width, 0)[0]
+    try:
+        points = [(x, 0) for x in roots.roots(
+            formula, left, right, samples=view.width
+        )]
+    except ValueError:
         return None
+    for other in formulas[:formulas.index(formula)]:
+        if other.tree == None:
+            continue
+        try:
+            points += roots.intersections(
+                formula, other, left, right, samples=view.width
+            )
+        except ValueError:
+            continue
+    for x, y in points:
+        canvasX, canvasY = toCanvas(x, y)
+        canvas.create_oval(
+            canvasX-3, canvasY-3, canvasX+3, canvasY+3,
+            outline=formula.color
+        )
 
-    x = round(view.zoom*fromCanvas(view.width/2,view.height/2)[0])
-    linePoints = []
-    bounds = round(0.5*view.width)+1
-    for num in range(x-bounds, x+bounds):
-        zNum = num/view.zoom
-        linePoints.append(toCanvas(zNum, formula.calculate(x=zNum)))
+def drawExtrema(formula:equations.equation):
+    """Mark and label the local minima and maxima of the formula in
+    view on the canvas. The formula is scanned once per pixel column,
+    and only the parts of the x axis not scanned before at this zoom are
+    scanned again.
+    """
+    left = fromCanvas(0, 0)[0]
+    right = fromCanvas(view.width, 0)[0]
+    try:
+        points = extrema.extrema(formula, left, right, 1/view.zoom)
+    except ValueError:
+        return None
+    for x, y, kind in points:
+        canvasX, canvasY = toCanvas(x, y)
+        if not 0 <= canvasY <= view.height:
+            continue
+        canvas.create_rectangle(
+            canvasX-3, canvasY-3, canvasX+3, canvasY+3,
+            outline=formula.color
+        )
+        offset = -12 if kind == "maximum" else 12
+        canvas.create_text(
+            canvasX, canvasY+offset, fill=formula.color,
+            text="(" + str(round(x,3)) + ", " + str(round(y,3)) + ")"
+        )
 
-    canvas.create_line(linePoints, fill=formula.color)
+# Calculates the formulas drawn by redrawFormulas on a pool of threads,
+# keeping them compiled together in batches so that subexpressions they
+# have in common are only calculated once.
+evaluation = scheduler.threadScheduler()
+
+def redrawFormulas():
+    """Draw every formula in the formula list on the canvas. Every
+    formula is calculated first, spread over evaluation's threads, and
+    then drawn here on the Tk thread.
+    """
+    drawn = [formula for formula in formulas if formula.tree != None]
+    zNums = viewSamples()
+    samples = sampling.sampleFormulas(evaluation, drawn, zNums, *viewRange())
+    for formula, (values, runs) in zip(drawn, samples):
+        drawSamples(formula, zNums, values, runs)
+    drawArea()
+
+def drawArea(tolerance=areaTolerance):
+    """Shade the area between areaBounds under the newest formula, or
+    between the two newest formulas if shadeBetween is set, and show
+    its integral. Everything drawn is tagged "area" so that it can be
+    redrawn alone while the bounds are dragged.
+    """
+    drawn = [formula for formula in formulas if formula.tree != None]
+    if not areaBounds or not drawn:
+        return None
+    upper = drawn[-1]
+    lower = drawn[-2] if shadeBetween.get() and len(drawn) > 1 else None
+    lo, hi = min(areaBounds), max(areaBounds)
+    try:
+        if lower == None:
+            value, error = integrals.integrate(upper, lo, hi, tolerance)
+        else:
+            value, error = integrals.integrateBetween(
+                upper, lower, lo, hi, tolerance
+            )
+    except ValueError:
+        return None
+    # Only the part of the area in view is shaded, one point per pixel
+    # column, with values off the canvas held at its edge.
+    top = fromCanvas(0, 0)[1]
+    bottom = fromCanvas(0, view.height)[1]
+    left = max(lo, fromCanvas(0, 0)[0])
+    right = min(hi, fromCanvas(view.width, 0)[0])
+    if left < right:
+        xs = roots.sampleAxis(
+            left, right, max(1, round((right-left)*view.zoom))
+        )
+        uppers = roots.sample(upper, xs)
+        if lower == None:
+            lowers = [0] * len(xs)
+        else:
+            lowers = roots.sample(lower, xs)
+        linePoints = []
+        for x, y in zip(xs, uppers):
+            y = min(max(y, bottom), top) if isfinite(y) else 0
+            linePoints.append(toCanvas(float(x), y))
+        for x, y in reversed(list(zip(xs, lowers))):
+            y = min(max(y, bottom), top) if isfinite(y) else 0
+            linePoints.append(toCanvas(float(x), y))
+        canvas.create_polygon(
+            linePoints, fill=upper.color, stipple="gray25", outline="",
+            tags="area"
+        )
+    text = "Area from x=" + str(round(lo,7)) + " to x=" + str(round(hi,7))
+    text += ": " + str(round(value,7)) + " \u00b1 " + str(round(error,7))
+    canvas.create_text(
+        10, 10, anchor="nw", text=text, fill=upper.color, tags="area"
+    )
+
+def beginArea(event):
+    """Start shading the area under the newest formula from the x
+    value of the provided event.
+    """
+    x = fromCanvas(event.x, event.y)[0]
+    areaBounds[:] = [x, x]
+
+def dragArea(event):
+    """Move the far bound of the shaded area to the x value of the
+    provided event, redrawing only the shaded area with a looser
+    tolerance so that dragging stays smooth.
+    """
+    if not areaBounds:
+        return None
+    areaBounds[1] = fromCanvas(event.x, event.y)[0]
+    canvas.delete("area")
+    drawArea(dragAreaTolerance)
+
+def endArea(event=None):
+    """Redraw the shaded area with its integral to full tolerance
+    once its bounds are no longer being dragged.
+    """
+    canvas.delete("area")
+    drawArea()
 
 def removeFormula(formula:equations.equation):
     """Delete a formula from the formula list and redraw the canvas
@@ -131,8 +360,7 @@ def removeFormula(formula:equations.equation):
     formulas.remove(formula)
     canvas.delete("all")
     drawAxes()
-    for formula in formulas:
-        drawFormula(formula, input=None)
+    redrawFormulas()
     listFormulas()
 
 
@@ -142,8 +370,17 @@ def listFormulas():
     for child in formulaDisplay.winfo_children():
         child.destroy()
     for formula in formulas:
+        text = "y=" + str(formula)[1:-1]
+        # Show the simplified form too when simplifying changed more
+        # than how multiplication is written.
+        simplified = formula.simplified()
+        tokens = equations.tokenize(
+            str(formula)[1:-1], formula.allowed, formula.variableNames
+        )
+        if simplified != equations.normalize(tokens):
+            text += " = " + simplified
         tkinter.Label(
-            formulaDisplay,text="y="+str(formula)[1:-1],
+            formulaDisplay,text=text,
             foreground=formula.color
         ).grid(row=count,column=0, sticky='W')
         tkinter.Button(
@@ -187,7 +424,7 @@ def drawAxes():
 def constructSolutionFrame(event):
     """Build a display that shows the x value of the provided event
     in planar coordinates, as well as the solution to each formula at
-    that x value.
+    that x value which is defined there.
     """
     hideSolutionFrame(event)
     x = fromCanvas(event.x, event.y)[0]
@@ -196,15 +433,19 @@ def constructSolutionFrame(event):
     ).grid(row=0,column=0,sticky='NW')
     count = 1
     for formula in formulas:
-        solution = formula.getSolution(x=x)
-        if solution:
-            text = str(formula)[1:-1] + "="
-            text += str(round(solution,7))
-            solution = ttk.Label(
-                solutionsDisplay, text=text, foreground=formula.color
-            )
-            solution.grid(row=count,column=0,sticky='NW')
-            count += 1
+        try:
+            solution = formula.calculate_masked(x=x)
+        except (ArithmeticError, ValueError):
+            continue
+        if not isfinite(solution):
+            continue
+        text = str(formula)[1:-1] + "="
+        text += str(round(solution,7))
+        solution = ttk.Label(
+            solutionsDisplay, text=text, foreground=formula.color
+        )
+        solution.grid(row=count,column=0,sticky='NW')
+        count += 1
     
 
 def hideSolutionFrame(event):
@@ -219,14 +460,21 @@ def dragCanvas(event):
     view.drag(event)
     canvas.delete("all")
     drawAxes()
-    for formula in formulas:
-        drawFormula(formula, input=None)
+    redrawFormulas()
     listFormulas()
 
 def beginDrag(event):
     """Pass on the beginning of a drag event to the canvas view."""
     view.dragStart(event)
 
+def toggleEnvelopes():
+    """Redraw the canvas after envelopes, roots or extrema are turned
+    on or off.
+    """
+    canvas.delete("all")
+    drawAxes()
+    redrawFormulas()
+
 def zoomChange(event):
     """Reduce or increase the zoom level of the canvas."""
     view.zoom += int(event.delta/abs(event.delta))
@@ -234,25 +482,41 @@ def zoomChange(event):
         view.zoom = 1
     canvas.delete("all")
     drawAxes()
-    for formula in formulas:
-        drawFormula(formula, input=None)
+    redrawFormulas()
 
 def addFormula():
     """Add a new formula to the formula list, draw it, and clear the
     input box.
     """
     drawFormula()
+    canvas.delete("area")
+    drawArea()
     listFormulas()
     formulaInput.delete('1.0',tkinter.END)
 
 
 tkinter.Button(frm, text="Draw", command=addFormula).grid(column=1,row=1)
+ttk.Checkbutton(
+    frm, text="Envelopes", variable=showEnvelopes, command=toggleEnvelopes
+).grid(column=1,row=2)
+ttk.Checkbutton(
+    frm, text="Roots", variable=showRoots, command=toggleEnvelopes
+).grid(column=1,row=3)
+ttk.Checkbutton(
+    frm, text="Between", variable=shadeBetween, command=endArea
+).grid(column=1,row=4)
+ttk.Checkbutton(
+    frm, text="Extrema", variable=showExtrema, command=toggleEnvelopes
+).grid(column=1,row=5)
 
 drawAxes()
 
 canvas.bind("<B1-Motion>", dragCanvas)
 canvas.bind("<Button-1>", beginDrag)
 canvas.bind("<MouseWheel>", zoomChange)
+canvas.bind("<Button-3>", beginArea)
+canvas.bind("<B3-Motion>", dragArea)
+canvas.bind("<ButtonRelease-3>", endArea)
 canvas.bind("<Enter>", constructSolutionFrame)
 canvas.bind("<Motion>", constructSolutionFrame)
 canvas.bind("<Leave>", hideSolutionFrame)
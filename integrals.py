@@ -0,0 +1,178 @@
+"""Calculates definite integrals of equations of x, and the area
+between two equations of x, by adaptive Gauss-Kronrod quadrature.
+"""
+
+import equations, roots
+from math import inf, isfinite
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The 15 points of the Kronrod rule on the interval -1 to 1, and the
+# weight of each in the Kronrod rule and in the 7 point Gauss rule which
+# uses every other one of them.
+kronrodNodes = (
+    -0.991455371120812639206854697526329,
+    -0.949107912342758524526189684047851,
+    -0.864864423359769072789712788640926,
+    -0.741531185599394439863864773280788,
+    -0.586087235467691130294144845693013,
+    -0.405845151377397166906606412076961,
+    -0.207784955007898467600689403773245,
+    0.0,
+    0.207784955007898467600689403773245,
+    0.405845151377397166906606412076961,
+    0.586087235467691130294144845693013,
+    0.741531185599394439863864773280788,
+    0.864864423359769072789712788640926,
+    0.949107912342758524526189684047851,
+    0.991455371120812639206854697526329,
+)
+kronrodWeights = (
+    0.022935322010529224963732008058970,
+    0.063092092629978553290700663189204,
+    0.104790010322250183839876322541518,
+    0.140653259715525918745189590510238,
+    0.169004726639267902826583426598550,
+    0.190350578064785409913256402421014,
+    0.204432940075298892414161999234649,
+    0.209482141084727828012999174891714,
+    0.204432940075298892414161999234649,
+    0.190350578064785409913256402421014,
+    0.169004726639267902826583426598550,
+    0.140653259715525918745189590510238,
+    0.104790010322250183839876322541518,
+    0.063092092629978553290700663189204,
+    0.022935322010529224963732008058970,
+)
+gaussWeights = (
+    0.0, 0.129484966168869693270611432679082,
+    0.0, 0.279705391489276667901467771423780,
+    0.0, 0.381830050505118944950369775488975,
+    0.0, 0.417959183673469387755102040816327,
+    0.0, 0.381830050505118944950369775488975,
+    0.0, 0.279705391489276667901467771423780,
+    0.0, 0.129484966168869693270611432679082,
+    0.0,
+)
+
+# Largest number of pieces an integral is divided into before the best
+# estimate so far is returned, however large its error.
+maxIntervals = 2000
+
+# Integrals already calculated, keyed by the equations, the bounds and
+# the tolerance, so that redrawing a shaded area does not calculate it
+# again.
+integralCache = equations.lruCache(maxEntries=256)
+
+def integrate(formula:equations.equation, lo:float, hi:float,
+              tolerance=1e-10):
+    """Return a tuple of the integral of the formula from x=lo to x=hi
+    and an estimate of its error, which is within tolerance, relative to
+    the integral where it is larger than 1, unless the formula could not
+    be integrated accurately. Requires the only variable in the equation
+    to be x.
+    """
+    key = ("integrate", roots.cacheKey(formula), lo, hi, tolerance)
+    found = integralCache.get(key)
+    if found == None:
+        found = gaussKronrod(
+            lambda xs: roots.sample(formula, xs), lo, hi, tolerance
+        )
+        integralCache.put(key, found)
+    return found
+
+def integrateBetween(formulaA:equations.equation,
+                     formulaB:equations.equation, lo:float, hi:float,
+                     tolerance=1e-10):
+    """Return a tuple of the integral of formulaA minus formulaB from
+    x=lo to x=hi and an estimate of its error, as integrate does. Where
+    formulaA is above formulaB throughout, this is the area between
+    them.
+    """
+    key = (
+        "integrateBetween", roots.cacheKey(formulaA),
+        roots.cacheKey(formulaB), lo, hi, tolerance
+    )
+    found = integralCache.get(key)
+    if found == None:
+        def sample(xs):
+            if numpy != None:
+                return roots.sample(formulaA, xs) - roots.sample(formulaB, xs)
+            return [
+                a - b for a, b in
+                zip(roots.sample(formulaA, xs), roots.sample(formulaB, xs))
+            ]
+        found = gaussKronrod(sample, lo, hi, tolerance)
+        integralCache.put(key, found)
+    return found
+
+def gaussKronrod(sample, lo:float, hi:float, tolerance:float):
+    """Return a tuple of the integral from lo to hi of the function
+    whose values at a list or array of points are returned by sample,
+    and an estimate of its error. The integral is divided into pieces,
+    each estimated with the 15 point Kronrod rule and the 7 point Gauss
+    rule, with the difference taken as its error. Every piece whose
+    error is more than its share of the tolerance is halved, and the
+    points of all the new pieces are sampled together in one call.
+    """
+    if lo == hi:
+        return (0.0, 0.0)
+    pending = [(lo, hi)]
+    total = 0.0
+    error = 0.0
+    count = 1
+    while pending:
+        xs = [
+            (a+b)/2 + (b-a)/2*node for a, b in pending
+            for node in kronrodNodes
+        ]
+        if numpy != None:
+            values = numpy.asarray(
+                sample(numpy.array(xs)), dtype=float
+            ).reshape(-1, 15)
+            kronrods = (values @ kronrodWeights).tolist()
+            gausses = (values @ gaussWeights).tolist()
+        else:
+            values = sample(xs)
+            kronrods = []
+            gausses = []
+            for start in range(0, len(values), 15):
+                chunk = values[start:start+15]
+                kronrods.append(
+                    sum(w*v for w, v in zip(kronrodWeights, chunk))
+                )
+                gausses.append(sum(w*v for w, v in zip(gaussWeights, chunk)))
+        estimates = []
+        for (a, b), kronrod, gauss in zip(pending, kronrods, gausses):
+            estimates.append(
+                (a, b, kronrod*(b-a)/2, abs(kronrod-gauss)*abs(b-a)/2)
+            )
+        bound = tolerance*max(
+            1, abs(total + sum(estimate[2] for estimate in estimates))
+        )
+        if error + sum(estimate[3] for estimate in estimates) <= bound:
+            pending = []
+        else:
+            accepted = []
+            pending = []
+            for estimate in estimates:
+                a, b, value, pieceError = estimate
+                middle = (a+b)/2
+                if (pieceError <= bound*abs((b-a)/(hi-lo))
+                        or count >= maxIntervals
+                        or middle == a or middle == b):
+                    accepted.append(estimate)
+                else:
+                    pending.append((a, middle))
+                    pending.append((middle, b))
+                    count += 1
+            estimates = accepted
+        for a, b, value, pieceError in estimates:
+            total += value
+            error += pieceError
+    if not isfinite(total):
+        error = inf
+    return (total, error)
@@ -0,0 +1,194 @@
+"""Finds where equations of x equal zero, and where two equations of x
+cross, over an interval.
+"""
+
+import equations
+from math import copysign, isfinite, nan
+from sys import float_info
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of intervals an interval of x is divided into when looking for
+# changes of sign. Roots closer together than one interval, and roots
+# where the equation touches zero without crossing it, may be missed.
+sampleCount = 512
+
+# Roots and intersections already found, keyed by the equations, the
+# interval of x and the settings they were found with, so the same view
+# can be marked again without searching it again.
+rootCache = equations.lruCache(maxEntries=256)
+
+def roots(formula:equations.equation, lo:float, hi:float,
+          samples=sampleCount, tolerance=1e-12):
+    """Return a sorted list of the values of x between lo and hi at
+    which the formula equals zero. Every one of samples intervals
+    between lo and hi is checked for a change of sign in one pass, and
+    each interval where one is found is narrowed down to the root with
+    Brent's method. Requires the only variable in the equation to be x.
+    """
+    key = ("roots", cacheKey(formula), lo, hi, samples, tolerance)
+    found = rootCache.get(key)
+    if found == None:
+        function = maskedFunction(formula)
+        xs = sampleAxis(lo, hi, samples)
+        values = sample(formula, xs)
+        found = refine(function, xs, values, tolerance)
+        rootCache.put(key, found)
+    return found
+
+def intersections(formulaA:equations.equation, formulaB:equations.equation,
+                  lo:float, hi:float, samples=sampleCount, tolerance=1e-12):
+    """Return a sorted list of the (x, y) points between lo and hi at
+    which two formulas are equal, found as the roots of their
+    difference in the same way as roots. Requires the only variable in
+    either equation to be x.
+    """
+    key = (
+        "intersections", cacheKey(formulaA), cacheKey(formulaB),
+        lo, hi, samples, tolerance
+    )
+    found = rootCache.get(key)
+    if found == None:
+        functionA = maskedFunction(formulaA)
+        functionB = maskedFunction(formulaB)
+        xs = sampleAxis(lo, hi, samples)
+        if numpy != None:
+            values = sample(formulaA, xs) - sample(formulaB, xs)
+        else:
+            values = [
+                a - b
+                for a, b in zip(sample(formulaA, xs), sample(formulaB, xs))
+            ]
+        found = [
+            (x, functionA(x)) for x in refine(
+                lambda x: functionA(x) - functionB(x), xs, values, tolerance
+            )
+        ]
+        rootCache.put(key, found)
+    return found
+
+def cacheKey(formula:equations.equation):
+    """Return the object identifying a formula in rootCache. Formulas
+    with the same text share one parsed equation, so they share their
+    roots too.
+    """
+    if formula.parsed != None:
+        return formula.parsed
+    return formula
+
+def sampleAxis(lo:float, hi:float, samples:int):
+    """Return samples+1 evenly spaced values of x from lo to hi, as an
+    array if NumPy is installed and as a list otherwise.
+    """
+    if numpy != None:
+        return numpy.linspace(lo, hi, samples+1)
+    return [lo + (hi-lo)*index/samples for index in range(samples+1)]
+
+def sample(formula:equations.equation, xs):
+    """Return the value of the formula at each of xs, with nan wherever
+    it is undefined or not finite, as an array if NumPy is installed
+    and as a list otherwise.
+    """
+    if numpy != None:
+        values = formula.calculate_array(x=xs)
+        values[~numpy.isfinite(values)] = nan
+        return values
+    function = maskedFunction(formula)
+    return [function(x) for x in xs]
+
+def maskedFunction(formula:equations.equation):
+    """Return a function of x calculating the formula as
+    calculate_masked does, with nan wherever its value is not finite,
+    so that roots and extrema are never looked for across poles or
+    where the formula is undefined. Requires the only variable in the
+    equation to be x.
+    """
+    calculate = formula.bind(("x",), masked=True)
+    def function(x):
+        value = calculate(x)
+        if type(value) == complex or not isfinite(value):
+            return nan
+        return value
+    return function
+
+def refine(function, xs, values, tolerance:float):
+    """Return a sorted list of the roots of function found from its
+    values at each of xs: each value which is exactly zero, and a root
+    narrowed down with brent between each neighbouring pair of values
+    of opposite signs. Changes of sign across a pole, where the
+    function grows rather than shrinks towards the root, are dropped.
+    """
+    if numpy != None:
+        values = numpy.asarray(values)
+        zeros = numpy.flatnonzero(values == 0).tolist()
+        changes = numpy.flatnonzero(values[:-1]*values[1:] < 0).tolist()
+    else:
+        zeros = [index for index, value in enumerate(values) if value == 0]
+        changes = [
+            index for index in range(len(values)-1)
+            if values[index]*values[index+1] < 0
+        ]
+    found = [float(xs[index]) for index in zeros]
+    for index in changes:
+        a, b = float(xs[index]), float(xs[index+1])
+        fa, fb = float(values[index]), float(values[index+1])
+        try:
+            root = brent(function, a, b, fa, fb, tolerance)
+            value = function(root)
+        except (ArithmeticError, ValueError):
+            continue
+        if isfinite(value) and abs(value) <= min(abs(fa), abs(fb)):
+            found.append(root)
+    return sorted(found)
+
+def brent(function, a:float, b:float, fa:float, fb:float,
+          tolerance=1e-12, maxIterations=100):
+    """Return a root of function between a and b, given its values fa
+    and fb at a and b, which must have opposite signs. Brent's method
+    takes inverse quadratic or secant steps where they narrow the
+    interval quickly and bisects where they do not, so it always
+    converges and usually does so in a few steps.
+    """
+    c, fc = b, fb
+    d = e = b - a
+    for iteration in range(maxIterations):
+        if (fb > 0) == (fc > 0):
+            c, fc = a, fa
+            d = e = b - a
+        if abs(fc) < abs(fb):
+            a, b, c = b, c, b
+            fa, fb, fc = fb, fc, fb
+        step = 2*float_info.epsilon*abs(b) + tolerance/2
+        middle = (c - b)/2
+        if abs(middle) <= step or fb == 0:
+            return b
+        if abs(e) >= step and abs(fa) > abs(fb):
+            s = fb/fa
+            if a == c:
+                p = 2*middle*s
+                q = 1 - s
+            else:
+                q = fa/fc
+                r = fb/fc
+                p = s*(2*middle*q*(q - r) - (b - a)*(r - 1))
+                q = (q - 1)*(r - 1)*(s - 1)
+            if p > 0:
+                q = -q
+            p = abs(p)
+            if 2*p < min(3*middle*q - abs(step*q), abs(e*q)):
+                e = d
+                d = p/q
+            else:
+                d = e = middle
+        else:
+            d = e = middle
+        a, fa = b, fb
+        if abs(d) > step:
+            b += d
+        else:
+            b += copysign(step, middle)
+        fb = function(b)
+    return b
@@ -0,0 +1,153 @@
+"""Chooses and calculates the samples of formulas drawn on the canvas of
+graphingCalculator, one per pixel column, without depending on tkinter,
+so that the drawing pipeline can be benchmarked and reused on its own.
+"""
+
+import equations
+from math import isfinite
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of pixel columns whose values are bounded together when
+# finding the parts of a formula's line which are off the canvas.
+cullBlockSize = 32
+
+def viewSamples(center:float, zoom:float, width:int):
+    """Return the x value of each pixel column of a canvas width pixels
+    wide, centered on x=center and showing zoom pixels per unit, as an
+    array if NumPy is installed and as a list otherwise.
+    """
+    x = round(zoom*center)
+    bounds = round(0.5*width)+1
+    if numpy != None:
+        return numpy.arange(x-bounds, x+bounds)/zoom
+    return [num/zoom for num in range(x-bounds, x+bounds)]
+
+def visibleRuns(formula:equations.equation, zNums, bottom:float,
+                top:float):
+    """Return a list of (start, stop) slices of zNums over which the
+    formula may be between bottom and top, using interval arithmetic to
+    rule out whole blocks of columns at once before any are calculated.
+    Each slice reaches one column past its blocks so that lines still
+    run to the edge of the canvas.
+    """
+    visible = []
+    for start in range(0, len(zNums), cullBlockSize):
+        stop = min(start + cullBlockSize, len(zNums))
+        low, high = formula.calculate_interval(
+            x=(zNums[start], zNums[stop-1])
+        )
+        visible.append(not (high < bottom or low > top))
+    return blockRuns(visible, len(zNums))
+
+def valueRuns(values, bottom:float, top:float):
+    """Return a list of (start, stop) slices of values, already
+    calculated, over which a line through them may be between bottom
+    and top, found from the least and greatest finite value of each
+    block of columns and the columns either side of it, as slices are
+    returned by visibleRuns.
+    """
+    count = len(values)
+    blocks = -(-count // cullBlockSize)
+    if numpy != None:
+        padded = numpy.full(blocks*cullBlockSize + 2, numpy.nan)
+        padded[1:count+1] = numpy.where(
+            numpy.isfinite(values), values, numpy.nan
+        )
+        inner = padded[1:-1].reshape(blocks, cullBlockSize)
+        # Each block's neighbours are the columns just before and after.
+        left = padded[0:-2:cullBlockSize]
+        right = padded[cullBlockSize+1::cullBlockSize]
+        low = numpy.fmin(numpy.fmin.reduce(inner, axis=1),
+                         numpy.fmin(left, right))
+        high = numpy.fmax(numpy.fmax.reduce(inner, axis=1),
+                          numpy.fmax(left, right))
+        visible = ((low <= top) & (high >= bottom)).tolist()
+    else:
+        visible = []
+        for start in range(0, count, cullBlockSize):
+            stop = min(start + cullBlockSize, count)
+            finite = [
+                value for value in values[max(start-1, 0):stop+1]
+                if isfinite(value)
+            ]
+            visible.append(bool(finite) and (
+                min(finite) <= top and max(finite) >= bottom
+            ))
+    return blockRuns(visible, count)
+
+def blockRuns(visible:list, count:int):
+    """Return a list of (start, stop) slices of count columns covering
+    each block of cullBlockSize columns which is visible, and one column
+    either side of it, with overlapping slices joined.
+    """
+    runs = []
+    for block, shown in enumerate(visible):
+        if not shown:
+            continue
+        start = max(block*cullBlockSize - 1, 0)
+        stop = min((block+1)*cullBlockSize + 1, count)
+        if runs and runs[-1][1] >= start:
+            runs[-1] = (runs[-1][0], stop)
+        else:
+            runs.append((start, stop))
+    return runs
+
+def finiteRuns(values, runs):
+    """Return the (start, stop) slices of values within each slice in
+    runs over which every value is finite, so that lines are broken
+    wherever the formula is undefined or infinite.
+    """
+    finite = []
+    for start, stop in runs:
+        if numpy != None:
+            mask = numpy.isfinite(values[start:stop])
+            # Each change between finite and not begins or ends a slice.
+            edges = numpy.flatnonzero(numpy.diff(mask)) + 1
+            bounds = [0] + edges.tolist() + [stop - start]
+            for low, high in zip(bounds, bounds[1:]):
+                if mask[low]:
+                    finite.append((start + low, start + high))
+        else:
+            low = None
+            for index in range(start, stop):
+                if isfinite(values[index]):
+                    if low == None:
+                        low = index
+                elif low != None:
+                    finite.append((low, index))
+                    low = None
+            if low != None:
+                finite.append((low, stop))
+    return finite
+
+def sampleFormula(formula:equations.equation, zNums, bottom:float,
+                  top:float):
+    """Return a tuple of the values of a newly drawn formula at zNums
+    and the runs of them which may be between bottom and top, as found
+    by visibleRuns. Only the columns in those runs are calculated.
+    """
+    runs = visibleRuns(formula, zNums, bottom, top)
+    if numpy != None:
+        values = numpy.zeros(len(zNums))
+    else:
+        values = [None] * len(zNums)
+    for start, stop in runs:
+        values[start:stop] = equations.calculateSamples(
+            formula, x=zNums[start:stop]
+        )
+    return (values, runs)
+
+def sampleFormulas(evaluation, formulas:list, zNums, bottom:float,
+                   top:float):
+    """Return a list of a tuple for each of formulas, as sampleFormula
+    does, calculating every column of every formula together on
+    evaluation, a scheduler.threadScheduler. Since every column is
+    calculated anyway, the runs in view are found from the values by
+    valueRuns rather than by interval arithmetic.
+    """
+    samples = evaluation.calculate(formulas, x=zNums)
+    return [(values, valueRuns(values, bottom, top)) for values in samples]
@@ -0,0 +1,236 @@
+"""Calculates many equations over the same samples at once by spreading
+them over a pool of threads. NumPy releases the interpreter lock while
+it works through arrays, so equations calculated by a backend which
+releasesLock run in parallel on machines with more than one core.
+
+Equations too slow to calculate by a single process, such as long
+formulas sampled for high resolution exports, can instead be split
+across a pool of processes, which share their samples and values
+through shared memory rather than pickling them.
+"""
+
+import array, multiprocessing, os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import equations
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of threads equations are spread over by default.
+workerCount = os.cpu_count() or 1
+
+# Fewest samples per equation worth sending to another thread. With
+# fewer, each NumPy call is too short for the time outside the lock to
+# make up for handing the work over.
+minimumSamples = 256
+
+# Number of samples each worker process calculates at a time by default.
+chunkSize = 65536
+
+# The equations parsed by a worker process, keyed by their description
+# from describe, so that each is only parsed once per process.
+workerEquations = equations.lruCache(maxEntries=64)
+
+class threadScheduler:
+    """Class calculating lists of equations over the same samples on a
+    pool of worker threads, started when first needed. The equations
+    are split into one batch per thread, each compiled together as an
+    equationGroup so that subexpressions common to a batch are only
+    calculated once. The groups are kept until the equations change.
+    """
+    def __init__(self, workers=None):
+        self.workers = workerCount if workers == None else workers
+        self.pool = None
+        self.groups = []
+
+    def batches(self, formulas:list):
+        """Split formulas into at most workers lists of consecutive
+        formulas, as nearly equal in length as possible.
+        """
+        count = max(1, min(self.workers, len(formulas)))
+        size, extra = divmod(len(formulas), count)
+        batches = []
+        start = 0
+        for index in range(count):
+            stop = start + size + (1 if index < extra else 0)
+            batches.append(formulas[start:stop])
+            start = stop
+        return batches
+
+    def groupBatches(self, formulas:list):
+        """Return an equationGroup for each batch of formulas, reusing
+        the groups from the last calculation where their equations have
+        not changed.
+        """
+        groups = []
+        for index, batch in enumerate(self.batches(formulas)):
+            trees = [formula.tree for formula in batch]
+            if index < len(self.groups) and self.groups[index].trees == trees:
+                groups.append(self.groups[index])
+            else:
+                groups.append(equations.equationGroup(batch))
+        self.groups = groups
+        return groups
+
+    def parallel(self, groups:list, count:int):
+        """Return whether groups are worth calculating on separate
+        threads for count samples. While metrics are enabled they are
+        calculated in turn, so that the times recorded are not mixed.
+        """
+        return len(groups) > 1 and count >= minimumSamples and (
+            not equations.metrics.enabled
+        ) and all(
+            equations.selectBackend(group, count).releasesLock
+            for group in groups
+        )
+
+    def calculate(self, formulas:list, **samples):
+        """Return a list of the values of each of formulas at every
+        sample, as equations.calculateSamples does for an equationGroup,
+        e.g. scheduler.calculate(formulas, x=xs). The calling thread
+        waits for every batch, so the results can be drawn right away.
+        """
+        groups = self.groupBatches(formulas)
+        if not self.parallel(groups, equations.sampleCount(samples)):
+            results = []
+            for group in groups:
+                results += equations.calculateSamples(group, **samples)
+            return results
+        if self.pool == None:
+            self.pool = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="scheduler"
+            )
+        futures = [
+            self.pool.submit(equations.calculateSamples, group, **samples)
+            for group in groups
+        ]
+        results = []
+        for future in futures:
+            results += future.result()
+        return results
+
+    def shutdown(self):
+        """Stop the pool's threads, which are started again if needed."""
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+
+class processScheduler:
+    """Class calculating an equation of x at very many samples on a
+    pool of worker processes, started when first needed. The samples
+    are split into chunks of chunkSize, and each worker reads its chunk
+    of samples from a shared memory block and writes the values into
+    another, so only the description of the equation is pickled. The
+    workers are started with the multiprocessing context named by
+    context, and "spawn" starts them fresh rather than copying a
+    process which may be running threads or a window. They only know
+    the operators and functions registered when equations is imported.
+    """
+    def __init__(self, workers=None, chunkSize=chunkSize, context="spawn"):
+        self.workers = workerCount if workers == None else workers
+        self.chunkSize = chunkSize
+        self.context = context
+        self.pool = None
+
+    def calculate(self, formula:equations.equation, xs):
+        """Return the value of the formula at each of xs, as a float
+        array if NumPy is installed and a list otherwise, with nan or
+        infinity where it is undefined. Requires the only variable in
+        the equation to be x.
+        """
+        if formula.tree == None:
+            raise ValueError("Equations must end with a number or variable.")
+        if not formula.variables() <= {"x"}:
+            raise ValueError("The only variable in " + str(formula)
+                             + " must be x.")
+        count = len(xs)
+        if count == 0:
+            return numpy.zeros(0) if numpy != None else []
+        if self.pool == None:
+            self.pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context(self.context)
+            )
+        inputs = shared_memory.SharedMemory(create=True, size=count*8)
+        outputs = shared_memory.SharedMemory(create=True, size=count*8)
+        try:
+            if numpy != None:
+                numpy.ndarray(count, dtype=float, buffer=inputs.buf)[:] = xs
+            else:
+                view = inputs.buf.cast("d")
+                view[:count] = array.array("d", map(float, xs))
+                view.release()
+            futures = [
+                self.pool.submit(
+                    calculateChunk, describe(formula), inputs.name,
+                    outputs.name, start, min(start + self.chunkSize, count)
+                )
+                for start in range(0, count, self.chunkSize)
+            ]
+            for future in futures:
+                future.result()
+            if numpy != None:
+                values = numpy.ndarray(
+                    count, dtype=float, buffer=outputs.buf
+                ).copy()
+            else:
+                view = outputs.buf.cast("d")
+                values = view[:count].tolist()
+                view.release()
+        finally:
+            for block in (inputs, outputs):
+                block.close()
+                block.unlink()
+        return values
+
+    def shutdown(self):
+        """Stop the pool's processes, which are started again if needed."""
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+
+def describe(formula:equations.equation):
+    """Return a tuple describing a formula, from which calculateChunk
+    can parse it again in another process.
+    """
+    return (
+        formula.text, tuple(formula.allowed), formula.operator,
+        formula.variableNames
+    )
+
+def calculateChunk(description:tuple, inputName:str, outputName:str,
+                   start:int, stop:int):
+    """Calculate the equation described by describe at the samples from
+    start to stop of the shared memory block named inputName, writing
+    its values to the same place in the block named outputName. Run in
+    the worker processes of a processScheduler.
+    """
+    formula = workerEquations.get(description)
+    if formula == None:
+        text, allowed, operator, variableNames = description
+        formula = equations.equation(
+            symbolStr=text, allowed=list(allowed), operator=operator,
+            variableNames=variableNames, solutions=equations.disabledCache()
+        )
+        workerEquations.put(description, formula)
+    inputs = shared_memory.SharedMemory(name=inputName)
+    outputs = shared_memory.SharedMemory(name=outputName)
+    try:
+        xs = inputs.buf.cast("d")[start:stop]
+        ys = outputs.buf.cast("d")[start:stop]
+        if numpy != None:
+            numpy.asarray(ys)[:] = equations.calculateSamples(
+                formula, x=numpy.asarray(xs)
+            )
+        else:
+            ys[:] = array.array(
+                "d", equations.calculateSamples(formula, x=xs.tolist())
+            )
+        xs.release()
+        ys.release()
+    finally:
+        inputs.close()
+        outputs.close()